@@ -0,0 +1,454 @@
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+judge_hosts = ['codeforces.com', 'atcoder.jp', 'api.tlx.toki.id']
+google_hosts = ['sheets.googleapis.com', 'script.google.com']
+scenarios = ['create_standings', 'list_standings', 'update_ratings_codeforces', 'update_ratings_atcoder', 'update_ratings_tlx']
+contest_start_timestamp = 1700000000
+
+
+class FakeJudgeData:
+    def __init__(self, n_users, n_contest_rows, history_length, seed=0):
+        self.n_users = n_users
+        self.n_contest_rows = n_contest_rows
+        self.history_length = history_length
+        self.seed = seed
+        self.bodies = {}
+        self.lock = threading.Lock()
+
+    def get_roster(self):
+        values = [['header'], ['header'], ['header']]
+        for i in range(self.n_users):
+            values.append(['-' if i % 5 == 0 else '+', f'User {i}', '', f'cf_user{i}', f'ac_user{i}', f'tlx_user{i}'])
+        return {'values': values}
+
+    def get_contest_rows(self, contest_id, prefix):
+        # roster members are spread among strangers, rows are in judge order
+        rng = random.Random(f'{self.seed}/{prefix}/{contest_id}')
+        n_roster = min(self.n_users, self.n_contest_rows)
+        roster_positions = set(rng.sample(range(self.n_contest_rows), n_roster))
+        roster_ids = iter(rng.sample(range(self.n_users), n_roster))
+        rows = []
+        for position in range(self.n_contest_rows):
+            handle = f'{prefix}{next(roster_ids)}' if position in roster_positions else f'stranger{position}'
+            rows.append((handle, (self.n_contest_rows - position) // 10, position % 97))
+        return rows
+
+    def get_codeforces_standings(self, contest_id):
+        rows = []
+        for handle, points, penalty in self.get_contest_rows(contest_id, 'cf_user'):
+            rows.append({
+                'party': {'contestId': contest_id, 'members': [{'handle': handle}], 'participantType': random.Random(handle).choice(['CONTESTANT', 'CONTESTANT', 'OUT_OF_COMPETITION', 'VIRTUAL', 'PRACTICE']), 'ghost': False},
+                'rank': len(rows) + 1,
+                'points': float(points),
+                'penalty': penalty,
+                'problemResults': [{'points': 500.0, 'rejectedAttemptCount': 0, 'type': 'FINAL'} for _ in range(6)],
+            })
+        contest = {'id': contest_id, 'name': f'Educational Codeforces Round {contest_id} (Rated for Div. 2)', 'phase': 'FINISHED', 'startTimeSeconds': contest_start_timestamp}
+        return {'status': 'OK', 'result': {'contest': contest, 'problems': [], 'rows': rows}}
+
+    def get_rating_changes(self, contest_id, prefix):
+        # every other participant is rated, the new rating continues the generated history
+        changes = []
+        for handle, _, _ in self.get_contest_rows(contest_id, prefix)[::2]:
+            rating = self.get_rating_history(handle)[-1][1] if handle.startswith(prefix) else 1500
+            changes.append((handle, max(0, rating + random.Random(f'{self.seed}/{handle}/{contest_id}').randint(-100, 100))))
+        return changes
+
+    def get_codeforces_rating_changes(self, contest_id):
+        return {'status': 'OK', 'result': [{'handle': handle, 'contestId': contest_id, 'ratingUpdateTimeSeconds': contest_start_timestamp + 3 * 60 * 60, 'newRating': rating} for handle, rating in self.get_rating_changes(contest_id, 'cf_user')]}
+
+    def get_rating_history(self, handle):
+        rng = random.Random(f'{self.seed}/{handle}')
+        rating = 1500
+        history = []
+        for i in range(self.history_length):
+            rating = max(0, rating + rng.randint(-100, 100))
+            history.append((contest_start_timestamp - (self.history_length - i) * 7 * 24 * 60 * 60, rating))
+        return history
+
+    def get_codeforces_user_rating(self, handle):
+        return {'status': 'OK', 'result': [{'handle': handle, 'contestId': i + 1, 'ratingUpdateTimeSeconds': timestamp, 'newRating': rating} for i, (timestamp, rating) in enumerate(self.get_rating_history(handle))]}
+
+    def get_codeforces_contests(self):
+        contests = [{'id': contest_id, 'name': f'Codeforces Round {contest_id} (Div. 2)', 'phase': 'FINISHED', 'durationSeconds': 2 * 60 * 60, 'startTimeSeconds': contest_start_timestamp} for contest_id in range(1100, 999, -1)]
+        return {'status': 'OK', 'result': contests}
+
+    def get_atcoder_archive_page(self, page):
+        # 50 contests per page from the newest one, like https://atcoder.jp/contests/archive
+        contest_numbers = range(400 - (page - 1) * 50, max(0, 400 - page * 50), -1)
+        rows = ''.join('<tr><td class="text-center"><a href="#"><time class=\'fixtime fixtime-full\'>2023-11-14 21:00:00+0900</time></a></td>'
+                       f'<td><a href="/contests/abc{number}">AtCoder Beginner Contest {number}</a></td>'
+                       '<td class="text-center">01:40</td><td class="text-center"> - 1999</td></tr>' for number in contest_numbers)
+        return f'<html><body><table><tbody>{rows}</tbody></table></body></html>'
+
+    def get_atcoder_standings(self, contest_id):
+        rows = []
+        for handle, points, penalty in self.get_contest_rows(contest_id, 'ac_user'):
+            rows.append({
+                'UserScreenName': handle,
+                'IsRated': True,
+                'OldRating': random.Random(handle).randint(0, 3000),
+                'TotalResult': {'Count': 1 + points % 7, 'Score': points * 100, 'Elapsed': penalty * 10 ** 9, 'Penalty': penalty % 3},
+            })
+        return {'Fixed': True, 'StandingsData': rows}
+
+    def get_atcoder_history(self, handle):
+        return [{'ContestScreenName': f'abc{i + 1}.contest.atcoder.jp', 'EndTime': datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%dT%H:%M:%S+09:00'), 'NewRating': rating, 'IsRated': True} for i, (timestamp, rating) in enumerate(self.get_rating_history(handle))]
+
+    def get_atcoder_results(self, contest_id):
+        end_time = datetime.utcfromtimestamp(contest_start_timestamp + 2 * 60 * 60).strftime('%Y-%m-%dT%H:%M:%S+09:00')
+        return [{'UserScreenName': handle, 'IsRated': True, 'ContestScreenName': f'{contest_id}.contest.atcoder.jp', 'EndTime': end_time, 'NewRating': rating} for handle, rating in self.get_rating_changes(contest_id, 'ac_user')]
+
+    def get_tlx_contests(self, page):
+        slugs = range(100 - (page - 1) * 50, max(0, 100 - page * 50), -1)
+        return {'data': {'page': [{'slug': f'troc-{i}', 'jid': f'JIDC{i}', 'name': f'TROC #{i}', 'beginTime': contest_start_timestamp * 1000, 'duration': 2 * 60 * 60 * 1000} for i in slugs]}}
+
+    def get_tlx_scoreboard(self, contest_jid):
+        entries = [{'contestantUsername': handle, 'totalPoints': points, 'totalPenalties': penalty} for handle, points, penalty in self.get_contest_rows(contest_jid, 'tlx_user')]
+        return {'data': {'scoreboard': {'content': {'entries': entries}}}}
+
+    def get_tlx_history(self, handle):
+        history = self.get_rating_history(handle)
+        return {
+            'data': [{'contestJid': f'JIDC{i}', 'rating': {'publicRating': rating}} for i, (_, rating) in enumerate(history)],
+            'contestsMap': {f'JIDC{i}': {'beginTime': timestamp * 1000} for i, (timestamp, _) in enumerate(history)},
+        }
+
+    def get_body(self, host, path, query):
+        if host == 'sheets.googleapis.com':
+            return self.get_roster()
+        if host == 'codeforces.com':
+            if path == '/api/contest.list':
+                return self.get_codeforces_contests()
+            if path == '/api/contest.standings':
+                return self.get_codeforces_standings(int(query['contestId'][0]))
+            if path == '/api/contest.ratingChanges':
+                return self.get_codeforces_rating_changes(int(query['contestId'][0]))
+            if path == '/api/user.rating':
+                return self.get_codeforces_user_rating(query['handle'][0])
+        if host == 'atcoder.jp':
+            parts = path.strip('/').split('/')
+            if parts == ['contests', 'archive']:
+                return self.get_atcoder_archive_page(int(query.get('page', ['1'])[0]))
+            if parts[0] == 'contests' and parts[2:] == ['results', 'json']:
+                return self.get_atcoder_results(parts[1])
+            if parts[0] == 'contests' and parts[2:] == ['standings', 'json']:
+                return self.get_atcoder_standings(parts[1])
+            if parts[0] == 'users' and parts[2:] == ['history', 'json']:
+                return self.get_atcoder_history(parts[1])
+        if host == 'api.tlx.toki.id':
+            parts = path.strip('/').split('/')
+            if parts == ['v2', 'contests']:
+                return self.get_tlx_contests(int(query.get('page', ['1'])[0]))
+            if parts[:2] == ['v2', 'contests'] and parts[3:] == ['scoreboard']:
+                return self.get_tlx_scoreboard(parts[2])
+            if parts == ['v2', 'contest-history', 'public']:
+                return self.get_tlx_history(query['username'][0])
+        return None
+
+    def get_encoded_body(self, host, path, query):
+        # standings are generated once, histories are cheap enough to build on every request
+        key = (host, path, tuple(sorted((name, tuple(values)) for name, values in query.items())))
+        with self.lock:
+            if key in self.bodies:
+                return self.bodies[key]
+        body = self.get_body(host, path, query)
+        if body is None:
+            return None
+        if isinstance(body, str):
+            encoded = ('text/html; charset=utf-8', body.encode())
+        else:
+            encoded = ('application/json', json.dumps(body).encode())
+        if path.find('standings') != -1 or path.find('scoreboard') != -1:
+            with self.lock:
+                self.bodies[key] = encoded
+        return encoded
+
+
+class FakeServerStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def snapshot(self):
+        with self.lock:
+            return {name: getattr(self, name) for name in ['requests', 'errors', 'rate_limited', 'bytes_sent', 'bytes_received']}
+
+
+class FakeServerBucket:
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+def make_handler(data, stats, latency, error_rate, server_rate):
+    buckets = {host: FakeServerBucket(server_rate) for host in judge_hosts} if server_rate > 0 else {}
+
+    class FakeHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_body(self, status_code, content_type, body, headers={}):
+            self.send_response(status_code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+            with stats.lock:
+                stats.bytes_sent += len(body)
+
+        def handle_request(self):
+            # the client sends https://<host>/<path> as http://127.0.0.1:<port>/<host>/<path>
+            parsed = urlparse(self.path)
+            host, _, path = parsed.path.lstrip('/').partition('/')
+            path = '/' + path
+            with stats.lock:
+                stats.requests += 1
+            if latency > 0:
+                time.sleep(latency)
+            if host in buckets and not buckets[host].try_acquire():
+                with stats.lock:
+                    stats.rate_limited += 1
+                self.send_body(429, 'text/plain', b'Call limit exceeded', {'Retry-After': '1'})
+                return None
+            if host in judge_hosts and random.random() < error_rate:
+                with stats.lock:
+                    stats.errors += 1
+                self.send_body(503, 'text/plain', b'Service Unavailable')
+                return None
+            return host, path, parse_qs(parsed.query)
+
+        def do_GET(self):
+            request = self.handle_request()
+            if request is None:
+                return
+            encoded = data.get_encoded_body(*request)
+            if encoded is None:
+                self.send_body(404, 'text/plain', b'Not Found')
+                return
+            self.send_body(200, *encoded)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            self.rfile.read(length)
+            with stats.lock:
+                stats.bytes_received += length
+            if self.handle_request() is None:
+                return
+            # the answer of doPost in spreadsheet_app.js
+            self.send_body(200, 'text/plain', b'ok')
+
+    return FakeHandler
+
+
+def start_fake_server(data, stats, latency, error_rate, server_rate):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(data, stats, latency, error_rate, server_rate))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def prepare_work_dir(work_dir, n_contests):
+    os.makedirs(os.path.join(work_dir, 'data'), exist_ok=True)
+    files = {
+        'spreadsheet_id.txt': 'benchmark',
+        'google_api_key.txt': 'benchmark',
+        'table_name.txt': 'benchmark',
+        'spreadsheet_app_id.txt': 'benchmark',
+        'cf_api_key.json': json.dumps({'key': 'benchmark', 'secret': 'benchmark'}),
+        'atcoder_cookies.json': json.dumps({'REVEL_SESSION': 'benchmark'}),
+    }
+    for name, content in files.items():
+        with open(os.path.join(work_dir, 'data', name), 'w') as f:
+            f.write(content)
+    with open(os.path.join(work_dir, 'list_standings.txt'), 'w') as f:
+        for i in range(n_contests):
+            if i % 3 == 0:
+                print(f'{1000 + i} "Codeforces Round {1000 + i} (Div. 2)"', file=f)
+            elif i % 3 == 1:
+                print(f'abc{300 + i}', file=f)
+            else:
+                print(f'troc-{i}', file=f)
+
+
+def get_peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def run_scenario(args):
+    # executed in a child process, so that peak RSS belongs to one scenario only
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(args.work_dir)
+    import main
+    from requests.adapters import HTTPAdapter
+
+    class LocalRedirectAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            parsed = urlparse(request.url)
+            request.url = f'{args.base_url}/{parsed.netloc}{parsed.path}' + (f'?{parsed.query}' if parsed.query else '')
+            return super().send(request, **kwargs)
+
+    def make_session():
+        session = main.requests.Session()
+        session.mount('https://', LocalRedirectAdapter(pool_maxsize=main.http_pool_size))
+        return session
+
+    for host in judge_hosts + google_hosts:
+        main.sessions[host] = make_session()
+    main.atcoder_session = make_session()
+    main.cache_mode = args.cache_mode
+    main.refresh_roster = True
+    main.host_rate_limits = {host: (args.client_rate, max(1, args.client_rate)) for host in judge_hosts} if args.client_rate > 0 else {}
+    main.backoff_base = args.backoff_base
+    main.get_users()
+
+    start_time = time.perf_counter()
+    if args.scenario == 'create_standings':
+        main.create_standings('codeforces', '1000', 'Codeforces Round 1000 (Div. 2)')
+    elif args.scenario == 'list_standings':
+        main.create_standings_from_list('list_standings.txt', args.jobs)
+    elif args.scenario.startswith('update_ratings_'):
+        main.update_ratings(args.scenario[len('update_ratings_'):], datetime.utcfromtimestamp(contest_start_timestamp - 10 * 7 * 24 * 60 * 60), 10, 200, args.jobs)
+    main.flush_outbox()
+    wall_time = time.perf_counter() - start_time
+    with open(args.result_file, 'w') as f:
+        json.dump({'wall_time': wall_time, 'peak_rss_mb': get_peak_rss_mb(), 'stages': main.metrics.to_json()}, f)
+
+
+def run_benchmark(args):
+    data = FakeJudgeData(args.users, args.contest_rows, args.history_length, args.seed)
+    stats = FakeServerStats()
+    server = start_fake_server(data, stats, args.latency, args.error_rate, args.server_rate)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        prepare_work_dir(work_dir, args.contests)
+        for scenario in args.scenarios:
+            before = stats.snapshot()
+            result_file = os.path.join(work_dir, 'result.json')
+            command = [sys.executable, os.path.abspath(__file__), '--run-scenario', scenario, '--base-url', base_url, '--work-dir', work_dir, '--result-file', result_file,
+                       '--jobs', str(args.jobs), '--client-rate', str(args.client_rate), '--cache-mode', args.cache_mode, '--backoff-base', str(args.backoff_base)]
+            print(f'Running {scenario}...')
+            subprocess.run(command, check=True, stdout=None if args.verbose else subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+            with open(result_file, 'r') as f:
+                result = json.load(f)
+            after = stats.snapshot()
+            delta = {name: after[name] - before[name] for name in after}
+            result['requests'] = delta['requests']
+            result['requests_per_second'] = delta['requests'] / result['wall_time'] if result['wall_time'] > 0 else None
+            result['retries'] = delta['errors'] + delta['rate_limited']
+            result['injected_errors'] = delta['errors']
+            result['rate_limited'] = delta['rate_limited']
+            result['bytes_downloaded'] = delta['bytes_sent']
+            result['bytes_uploaded'] = delta['bytes_received']
+            results[scenario] = result
+            print(f"{scenario}: {result['wall_time']:.2f} s, {result['requests']} requests, {result['retries']} retries")
+    server.shutdown()
+    return results
+
+
+def get_git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def print_comparison(baseline, report):
+    metrics = ['wall_time', 'requests_per_second', 'peak_rss_mb', 'requests', 'retries', 'bytes_uploaded']
+    print(f"Comparison with {baseline.get('revision')}:")
+    for scenario, result in report['scenarios'].items():
+        if scenario not in baseline['scenarios']:
+            continue
+        changes = []
+        for metric in metrics:
+            old_value, new_value = baseline['scenarios'][scenario].get(metric), result.get(metric)
+            if old_value and new_value is not None:
+                changes.append(f'{metric} {old_value:.4g} -> {new_value:.4g} ({(new_value - old_value) / old_value * 100:+.1f}%)')
+        print(f"{scenario}: {', '.join(changes)}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='offline benchmark of main.py against local stand-ins for the judges and Google')
+    parser.add_argument('--scenarios', nargs='+', choices=scenarios, default=scenarios, help='scenarios to run')
+    parser.add_argument('--users', type=int, default=300, help='number of users in the roster')
+    parser.add_argument('--contest-rows', type=int, default=20000, help='number of rows in every contest standings')
+    parser.add_argument('--contests', type=int, default=12, help='number of contests in the list for the list_standings scenario')
+    parser.add_argument('--history-length', type=int, default=30, help='number of rated contests in every rating history')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds the fake servers wait before every response')
+    parser.add_argument('--error-rate', type=float, default=0.02, help='share of judge requests answered with 503')
+    parser.add_argument('--server-rate', type=float, default=20, help='requests per second every fake judge accepts before answering 429, 0 for no limit')
+    parser.add_argument('--client-rate', type=float, default=20, help='requests per second main.py is allowed to send to every judge, 0 for no limit')
+    parser.add_argument('--backoff-base', type=float, default=0.1, help='base of the exponential backoff of main.py in seconds')
+    parser.add_argument('--cache-mode', choices=['off', 'refresh', 'default'], default='off', help='response cache mode of main.py')
+    parser.add_argument('-j', '--jobs', type=int, default=8, help='number of concurrent requests of main.py')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data')
+    parser.add_argument('-o', '--output', type=str, default='bench_results.json', help='file to write the results to')
+    parser.add_argument('--baseline', type=str, help='results of another version to compare with')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show the output of main.py')
+    parser.add_argument('--run-scenario', choices=scenarios, help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', type=str, help=argparse.SUPPRESS)
+    parser.add_argument('--work-dir', type=str, help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run_scenario is not None:
+        args.scenario = args.run_scenario
+        run_scenario(args)
+        return
+    report = {
+        'revision': get_git_revision(),
+        'timestamp': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {name: getattr(args, name) for name in ['users', 'contest_rows', 'contests', 'history_length', 'latency', 'error_rate', 'server_rate', 'client_rate', 'backoff_base', 'cache_mode', 'jobs', 'seed']},
+        'scenarios': run_benchmark(args),
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results are written to {args.output}')
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            print_comparison(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main_cli()
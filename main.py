@@ -1,19 +1,33 @@
 import os
+import re
 import sys
 import time
+import gzip
+import html
 import json
+import base64
 import random
+import uuid
 import string
 import hashlib
+import tempfile
+import cProfile
 import argparse
+import contextlib
+import threading
+import email.utils
 import requests
-import jsonpickle
-import onlinejudge
-from tqdm import tqdm
-from datetime import datetime
+import results_store
+from requests.adapters import HTTPAdapter
+from array import array
+from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
 
 
+online_judges = ['codeforces', 'atcoder', 'tlx']
+
+
 class User:
     def __init__(self, name, codeforces_handle, atcoder_handle, tlx_handle, is_official):
         def filter_handle(handle):
@@ -44,6 +58,8 @@ class User:
 
 
 class StandingsRow:
+    __slots__ = ['user', 'place', 'points', 'penalty', 'user_group']
+
     def __init__(self, user, place, points, penalty, user_group):
         self.user = user
         self.place = place
@@ -56,49 +72,623 @@ class StandingsRow:
 
 
 class Standings:
+    n_user_groups = 3
+
     def __init__(self, online_judge, contest_id, start_date):
         assert(online_judge in online_judges)
         self.online_judge = online_judge
         self.contest_id = contest_id
         self.start_date = start_date
-        self.results = []
-        self.last_id = [-1 for i in range(3)]
-        self.n_participants = [0 for i in range(3)]
-
-    def add_result(self, handle, points, penalty, user_group):
-        user = handles_by_judges[self.online_judge][handle]
-        place = 1
-        if self.last_id[user_group] != -1:
-            place = self.results[self.last_id[user_group]].place
-            if points != self.results[self.last_id[user_group]].points or penalty != self.results[self.last_id[user_group]].penalty:
-                place = self.n_participants[user_group] + 1
-        self.n_participants[user_group] += 1
-        self.last_id[user_group] = len(self.results)
-        self.results.append(StandingsRow(user, place, points, penalty, user_group))
+        self.users = []
+        self.points = array('d')
+        self.penalty = array('q')
+        self.user_group = array('b')
+        self.place = array('q')
+        self.n_participants = [0 for i in range(self.n_user_groups)]
+        self.group_starts = [0 for i in range(self.n_user_groups + 1)]
+        self.ranked = True
+
+    @classmethod
+    def from_rows(cls, online_judge, contest_id, start_date, rows):
+        handles = get_handles_by_judges()[online_judge]
+        return cls.from_user_rows(online_judge, contest_id, start_date, ((handles[handle], points, penalty, user_group) for handle, points, penalty, user_group in rows))
+
+    @classmethod
+    def from_user_rows(cls, online_judge, contest_id, start_date, rows):
+        standings = cls(online_judge, contest_id, start_date)
+        for user, points, penalty, user_group in rows:
+            standings.users.append(user)
+            standings.points.append(points)
+            standings.penalty.append(penalty)
+            standings.user_group.append(user_group)
+        standings.ranked = False
+        standings.rank()
+        return standings
+
+    def rank(self):
+        if self.ranked:
+            return
+        with span('rank', online_judge=self.online_judge):
+            self.rank_rows()
+
+    def rank_rows(self):
+        points, penalty, user_group = self.points, self.penalty, self.user_group
+        order = sorted(range(len(self.users)), key=lambda i: (user_group[i], -points[i], penalty[i]))
+        self.users = [self.users[i] for i in order]
+        self.points = array('d', (points[i] for i in order))
+        self.penalty = array('q', (penalty[i] for i in order))
+        self.user_group = array('b', (user_group[i] for i in order))
+        self.place = array('q', bytes(8 * len(order)))
+        self.n_participants = [0 for i in range(self.n_user_groups)]
+        for i in range(len(order)):
+            group = self.user_group[i]
+            if self.n_participants[group] > 0 and self.points[i] == self.points[i - 1] and self.penalty[i] == self.penalty[i - 1]:
+                self.place[i] = self.place[i - 1]
+            else:
+                self.place[i] = self.n_participants[group] + 1
+            self.n_participants[group] += 1
+        for group in range(self.n_user_groups):
+            self.group_starts[group + 1] = self.group_starts[group] + self.n_participants[group]
+        self.ranked = True
+
+    @property
+    def results(self):
+        self.rank()
+        return [StandingsRow(*row) for row in zip(self.users, self.place, self.points, self.penalty, self.user_group)]
+
+    def __len__(self):
+        return len(self.users)
 
     def empty(self):
-        for result in self.results:
-            if result.points != 0:
-                return False
-        return True
+        return not any(self.points)
 
     def __str__(self):
         return '\n'.join([str(row) for row in self.results])
 
 
-def load_users():
-    spreadsheet_id = open('data/spreadsheet_id.txt', 'r').read()
-    google_api_key = open('data/google_api_key.txt', 'r').read()
-    table_name = open('data/table_name.txt', 'r').read()
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = {}
+        self.counters = {}
+
+    def add_span(self, name, labels, seconds):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            span = self.spans.setdefault(key, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            span['count'] += 1
+            span['seconds'] += seconds
+            span['max_seconds'] = max(span['max_seconds'], seconds)
+
+    def add(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def to_json(self):
+        with self.lock:
+            return {
+                'spans': [dict(name=name, labels=dict(labels), **span) for (name, labels), span in sorted(self.spans.items())],
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in sorted(self.counters.items())],
+            }
+
+    def to_prometheus(self):
+        def format_labels(labels):
+            if len(labels) == 0:
+                return ''
+            return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+        lines = []
+        with self.lock:
+            for metric, field, description in [('span_seconds_total', 'seconds', 'Total time spent in the stage'),
+                                               ('span_count_total', 'count', 'Number of times the stage was executed'),
+                                               ('span_max_seconds', 'max_seconds', 'Longest execution of the stage')]:
+                lines.append(f'# HELP {metrics_prefix}_{metric} {description}')
+                lines.append(f"# TYPE {metrics_prefix}_{metric} {'gauge' if metric.endswith('max_seconds') else 'counter'}")
+                for (name, labels), span in sorted(self.spans.items()):
+                    lines.append(f"{metrics_prefix}_{metric}{format_labels((('span', name),) + labels)} {span[field]}")
+            for name in sorted(set(name for name, _ in self.counters)):
+                lines.append(f'# TYPE {metrics_prefix}_{name}_total counter')
+                for (counter_name, labels), value in sorted(self.counters.items()):
+                    if counter_name == name:
+                        lines.append(f'{metrics_prefix}_{name}_total{format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename):
+        if filename.endswith('.prom'):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_json(), indent=2)
+        if filename == '-':
+            print(content)
+            return
+        with open(filename + '.tmp', 'w') as f:
+            f.write(content)
+        os.replace(filename + '.tmp', filename)
+
+
+metrics_prefix = 'rating_calculator'
+metrics = Metrics()
+profilers = None
+
+
+@contextlib.contextmanager
+def span(name, **labels):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_span(name, labels, time.perf_counter() - start_time)
+
+
+def profiled(function):
+    # cProfile only sees the thread it was enabled in, so tasks of thread pools are profiled separately
+    def wrapper(*args, **kwargs):
+        if profilers is None:
+            return function(*args, **kwargs)
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(function, *args, **kwargs)
+        finally:
+            profilers.append(profiler)
+    return wrapper
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+# (requests per second, burst size) for every judge host, hosts without entry are not limited
+host_rate_limits = {
+    'codeforces.com': (0.5, 1),
+    'atcoder.jp': (1, 1),
+    'api.tlx.toki.id': (5, 5),
+}
+retryable_status_codes = {429, 500, 502, 503, 504}
+max_retries = 8
+backoff_base = 1
+backoff_cap = 60
+request_timeout = 60
+http_pool_size = 64
+default_n_workers = 8
+
+sessions = {}
+rate_limiters = {}
+http_lock = threading.Lock()
+
+# seconds to keep a response of every endpoint, first matching prefix of the normalized url wins
+cache_ttls = [
+    ('https://codeforces.com/api/contest.standings', 10 * 60),
+    ('https://codeforces.com/api/contest.ratingchanges', 10 * 60),
+    ('https://codeforces.com/api/user.rating', 6 * 60 * 60),
+    ('https://atcoder.jp/users/', 6 * 60 * 60),
+    ('https://atcoder.jp/contests/', 10 * 60),
+    ('https://api.tlx.toki.id/v2/contests/', 10 * 60),
+    ('https://api.tlx.toki.id/v2/contest-history/', 6 * 60 * 60),
+]
+cache_excluded_params = {'apiKey', 'time', 'apiSig'}
+cache_max_size = 512 * 1024 * 1024
+stream_chunk_size = 1 << 16
+# standings of contests that ended this many seconds ago are final and are cached forever
+standings_final_delay = 24 * 60 * 60
+# 'default' uses fresh entries and revalidates stale ones, 'refresh' always downloads, 'off' disables the cache
+cache_mode = 'default'
+
+
+def normalize_url(url):
+    parsed = urlparse(url)
+    query_params = sorted((key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True) if key not in cache_excluded_params)
+    return urlunparse((parsed.scheme.lower(), parsed.netloc.lower(), parsed.path, '', urlencode(query_params), ''))
+
+
+def get_cache_ttl(url):
+    normalized_url = normalize_url(url).lower()
+    for prefix, ttl in cache_ttls:
+        if normalized_url.startswith(prefix):
+            return ttl
+    return 0
+
+
+class ResponseCache:
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.size = None
+        self.lock = threading.Lock()
+
+    def get_paths(self, url):
+        key = hashlib.sha256(normalize_url(url).encode()).hexdigest()
+        path = os.path.join(self.directory, key)
+        return path + '.json', path + '.body'
+
+    def load_meta(self, url):
+        meta_path, body_path = self.get_paths(url)
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            os.utime(body_path)
+        except (OSError, ValueError):
+            return None
+        return meta
+
+    def write_meta(self, url, meta):
+        meta_path, _ = self.get_paths(url)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def store(self, url, response, ttl):
+        os.makedirs(self.directory, exist_ok=True)
+        meta_path, body_path = self.get_paths(url)
+        tmp_path = f'{body_path}.{threading.get_ident()}.tmp'
+        size = 0
+        with open(tmp_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=stream_chunk_size):
+                f.write(chunk)
+                size += len(chunk)
+        with self.lock:
+            if self.size is None:
+                self.size = self.get_total_size()
+            if os.path.isfile(body_path):
+                self.size -= os.path.getsize(body_path)
+            os.replace(tmp_path, body_path)
+            self.size += size
+        self.write_meta(url, {
+            'url': normalize_url(url),
+            'status_code': response.status_code,
+            'encoding': response.encoding,
+            'headers': {name: response.headers[name] for name in ['Content-Type', 'ETag', 'Last-Modified'] if name in response.headers},
+            'expires_at': time.time() + ttl,
+        })
+        self.evict(keep=body_path)
+        return size
+
+    def refresh(self, url, meta, ttl):
+        meta['expires_at'] = time.time() + ttl
+        self.write_meta(url, meta)
+
+    def keep_forever(self, url):
+        meta = self.load_meta(url)
+        if meta is not None:
+            meta['expires_at'] = None
+            self.write_meta(url, meta)
+
+    def get_total_size(self):
+        if not os.path.isdir(self.directory):
+            return 0
+        return sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.name.endswith('.body'))
+
+    def evict(self, keep=None):
+        with self.lock:
+            if self.size <= self.max_size:
+                return
+            entries = sorted((entry for entry in os.scandir(self.directory) if entry.name.endswith('.body')), key=lambda entry: entry.stat().st_mtime)
+            for entry in entries:
+                if self.size <= self.max_size:
+                    break
+                if entry.path == keep:
+                    continue
+                self.size -= entry.stat().st_size
+                for path in [entry.path, entry.path[:-len('.body')] + '.json']:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    @staticmethod
+    def is_fresh(meta):
+        return meta['expires_at'] is None or meta['expires_at'] > time.time()
+
+    def to_response(self, url, meta, stream=False):
+        _, body_path = self.get_paths(url)
+        body = open(body_path, 'rb')
+        if stream:
+            return make_file_response(url, meta['status_code'], meta['encoding'], meta['headers'], body)
+        with body:
+            response = make_file_response(url, meta['status_code'], meta['encoding'], meta['headers'], None)
+            response._content = body.read()
+        return response
+
+
+def make_file_response(url, status_code, encoding, headers, body):
+    response = requests.models.Response()
+    response.url = url
+    response.status_code = status_code
+    response.encoding = encoding
+    response.headers.update(headers)
+    response.raw = body
+    return response
+
+
+response_cache = ResponseCache('data/cache', cache_max_size)
+
+
+def cache_forever(url):
+    if cache_mode != 'off':
+        response_cache.keep_forever(url)
+
+
+def get_session(host):
+    with http_lock:
+        if host not in sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=http_pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            sessions[host] = session
+        return sessions[host]
+
+
+def get_rate_limiter(host):
+    with http_lock:
+        if host not in rate_limiters and host in host_rate_limits:
+            rate_limiters[host] = TokenBucket(*host_rate_limits[host])
+        return rate_limiters.get(host)
+
+
+def get_retry_delay(response, attempt):
+    delay = random.uniform(0, min(backoff_cap, backoff_base * 2 ** attempt))
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after:
+        if retry_after.isdigit():
+            return max(delay, int(retry_after))
+        try:
+            retry_at = email.utils.parsedate_to_datetime(retry_after)
+            return max(delay, retry_at.timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return delay
+
+
+def http_get(url, session=None, use_cache=True, stream=False, refresh=False, **kwargs):
+    # refresh downloads the response again and updates the cache like --refresh, for a single request
+    ttl = get_cache_ttl(url) if use_cache and cache_mode != 'off' else 0
+    meta = None
+    if ttl > 0 and cache_mode == 'default' and not refresh:
+        meta = response_cache.load_meta(url)
+    host = urlparse(url).hostname
+    if meta is not None:
+        if ResponseCache.is_fresh(meta):
+            metrics.add('cache_hits', 1, host=host)
+            return response_cache.to_response(url, meta, stream)
+        headers = dict(kwargs.pop('headers', None) or {})
+        if 'ETag' in meta['headers']:
+            headers['If-None-Match'] = meta['headers']['ETag']
+        if 'Last-Modified' in meta['headers']:
+            headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+        kwargs['headers'] = headers
+    response = http_get_uncached(url, session, stream=stream, **kwargs)
+    if meta is not None and response.status_code == 304:
+        metrics.add('cache_revalidations', 1, host=host)
+        response.close()
+        response_cache.refresh(url, meta, ttl)
+        return response_cache.to_response(url, meta, stream)
+    if response.status_code != 200 or not (ttl > 0 or stream):
+        return response
+    if ttl == 0:
+        body = tempfile.TemporaryFile()
+        with span('download', host=host):
+            for chunk in response.iter_content(chunk_size=stream_chunk_size):
+                body.write(chunk)
+                metrics.add('bytes_downloaded', len(chunk), host=host)
+        body.seek(0)
+        return make_file_response(url, response.status_code, response.encoding, response.headers, body)
+    with span('download', host=host):
+        size = response_cache.store(url, response, ttl)
+    if stream:
+        metrics.add('bytes_downloaded', size, host=host)
+    if not stream:
+        return response
+    return response_cache.to_response(url, response_cache.load_meta(url), stream)
+
+
+def http_get_uncached(url, session=None, **kwargs):
+    host = urlparse(url).hostname
+    if session is None:
+        session = get_session(host)
+    rate_limiter = get_rate_limiter(host)
+    kwargs.setdefault('timeout', request_timeout)
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            with span('rate_limit_wait', host=host):
+                rate_limiter.acquire()
+        if attempt > 0:
+            metrics.add('retries', 1, host=host)
+        try:
+            with span('http_request', host=host):
+                response = session.get(url, **kwargs)
+        except requests.RequestException as e:
+            if attempt == max_retries:
+                raise
+            print(f'Request to {url} failed ({e}), retrying')
+            time.sleep(get_retry_delay(None, attempt))
+            continue
+        metrics.add('responses', 1, host=host, status=response.status_code)
+        if response.status_code not in retryable_status_codes or attempt == max_retries:
+            if not kwargs.get('stream'):
+                metrics.add('bytes_downloaded', len(response.content), host=host)
+            return response
+        response.close()
+        delay = get_retry_delay(response, attempt)
+        metrics.add('retry_wait_seconds', delay, host=host, status=response.status_code)
+        time.sleep(delay)
+    return response
+
+
+targets_directory = 'data/targets'
+default_target_directory = 'data'
+google_api_key_path = 'data/google_api_key.txt'
+roster_ttl = 60 * 60
+refresh_roster = False
+selected_targets = None
+targets = None
+users = None
+handles_by_judges = None
+roster_lock = threading.Lock()
+
+
+class Target:
+    # a rating table: a spreadsheet with its participants list and its apps script;
+    # a single table keeps its files in data/, several tables each have a directory in data/targets/
+    def __init__(self, name, directory):
+        self.name = name
+        self.directory = directory
+        self.roster_cache_path = os.path.join(directory, 'roster.json')
+        self.posted_standings_path = os.path.join(directory, 'posted_standings.json')
+        self.store_path = os.path.join(directory, 'results.sqlite')
+        self.outbox = Outbox(os.path.join(directory, 'outbox'), self)
+        self.users = None
+        self.handles_by_judges = None
+
+    def __str__(self):
+        return self.name
+
+    def read_file(self, filename):
+        return open(os.path.join(self.directory, filename), 'r').read()
+
+    def get_users(self):
+        if self.users is None:
+            self.users = load_users(self, refresh_roster)
+        return self.users
+
+    def get_handles_by_judges(self):
+        if self.handles_by_judges is None:
+            self.handles_by_judges = {
+                online_judge: {user.get_handle(online_judge) : user for user in self.get_users() if user.get_handle(online_judge) != ''} for online_judge in online_judges
+            }
+        return self.handles_by_judges
+
+
+def find_targets():
+    if not os.path.isdir(targets_directory):
+        return [Target('default', default_target_directory)]
+    names = sorted(name for name in os.listdir(targets_directory) if os.path.isfile(os.path.join(targets_directory, name, 'spreadsheet_id.txt')))
+    return [Target(name, os.path.join(targets_directory, name)) for name in names]
+
+
+def get_targets():
+    global targets
+    if targets is None:
+        with roster_lock:
+            if targets is None:
+                found = find_targets()
+                if selected_targets is not None:
+                    unknown = set(selected_targets) - {target.name for target in found}
+                    if unknown:
+                        raise ValueError(f"Unknown tables {', '.join(sorted(unknown))}, the tables are {', '.join(target.name for target in found)}")
+                    found = [target for target in found if target.name in selected_targets]
+                targets = found
+    return targets
+
+
+def get_target(name=None):
+    # the first table by default
+    for target in get_targets():
+        if name is None or target.name == name:
+            return target
+    raise ValueError(f"Unknown table {name}, the tables are {', '.join(target.name for target in get_targets())}")
+
+
+def get_roster_fingerprint(values):
+    return hashlib.sha256(json.dumps(values, ensure_ascii=False, sort_keys=True).encode()).hexdigest()
+
+
+def load_roster(target, force_refresh=False):
+    cached_roster = None
+    if os.path.isfile(target.roster_cache_path):
+        with open(target.roster_cache_path, 'r', encoding='utf-8') as f:
+            cached_roster = json.load(f)
+        if not force_refresh and cached_roster['fetched_at'] + roster_ttl > time.time():
+            return cached_roster
+    spreadsheet_id = target.read_file('spreadsheet_id.txt')
+    google_api_key = open(google_api_key_path, 'r').read()
+    table_name = target.read_file('table_name.txt')
     url = f'https://sheets.googleapis.com/v4/spreadsheets/{spreadsheet_id}/values/{table_name}?alt=json&key={google_api_key}'
-    data = requests.get(url).json()['values']
+    with span('load_roster', target=target.name):
+        values = http_get(url, use_cache=False).json()['values']
+    roster = {
+        'fetched_at': time.time(),
+        'fingerprint': get_roster_fingerprint(values),
+        'values': values,
+    }
+    if cached_roster is not None and cached_roster['fingerprint'] != roster['fingerprint']:
+        print(f'Participants list of {target} has changed since the last run')
+    os.makedirs(target.directory, exist_ok=True)
+    with open(target.roster_cache_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(roster, f, ensure_ascii=False)
+    os.replace(target.roster_cache_path + '.tmp', target.roster_cache_path)
+    return roster
+
+
+def load_users(target, force_refresh=False):
+    data = load_roster(target, force_refresh)['values']
     users = [User(row[1], row[3], row[4], row[5], row[0] != '-') for row in data[3:]]
     return users
 
 
-def print_failed_request_info(response):
-    print(f'{response.status_code}: incorrect parameters (check contest id), try again')
-    print(response.text)
+def merge_users(same_users):
+    # a handle listed in several tables is official if it is official in any of them,
+    # the tables that list it as unofficial move it to the last group when their standings are filtered
+    if len(same_users) == 1:
+        return same_users[0]
+    user = same_users[0]
+    return User(user.name, user.codeforces_handle, user.atcoder_handle, user.tlx_handle, any(same_user.is_official for same_user in same_users))
+
+
+def get_users():
+    # participants of all tables, the users of one table are target.get_users()
+    global users
+    if users is None:
+        loaded_targets = get_targets()
+        with roster_lock:
+            if users is None:
+                with ThreadPoolExecutor(max_workers=len(loaded_targets)) as executor:
+                    rosters = list(executor.map(lambda target: target.get_users(), loaded_targets))
+                users = [user for roster in rosters for user in roster]
+    return users
+
+
+def get_handles_by_judges():
+    global handles_by_judges
+    if handles_by_judges is None:
+        get_users()
+        loaded_targets = get_targets()
+        if len(loaded_targets) == 1:
+            handles_by_judges = loaded_targets[0].get_handles_by_judges()
+        else:
+            handles_by_judges = {}
+            for online_judge in online_judges:
+                same_users = {}
+                for target in loaded_targets:
+                    for handle, user in target.get_handles_by_judges()[online_judge].items():
+                        same_users.setdefault(handle, []).append(user)
+                handles_by_judges[online_judge] = {handle: merge_users(handle_users) for handle, handle_users in same_users.items()}
+    return handles_by_judges
+
+
+class StandingsError(Exception):
+    pass
+
+
+def get_failed_request_info(response):
+    return f'{response.status_code}: incorrect parameters (check contest id), try again\n{response.text}'
 
 
 def compose_authorized_codeforces_request(url):
@@ -123,213 +713,895 @@ def compose_authorized_codeforces_request(url):
     return final_url
 
 
-def get_codeforces_rated_contestants(contest_id):
+def iterate_json_items(f, prefix):
+    # only the time spent inside the parser is recorded, not the processing of the yielded items
+    import ijson
+    items = ijson.items(f, prefix, use_float=True)
+    seconds = 0
+    try:
+        while True:
+            start_time = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            finally:
+                seconds += time.perf_counter() - start_time
+            yield item
+    finally:
+        metrics.add_span('json_decode', {'prefix': prefix}, seconds)
+
+
+def read_json_item(f, prefix):
+    for item in iterate_json_items(f, prefix):
+        return item
+    raise StandingsError(f"Can't find {prefix} in the response")
+
+
+contest_index_path = 'data/contests.json'
+# a contest missing from the index triggers an update of its judge at most once in this many seconds
+contest_index_min_update_interval = 5 * 60
+refresh_contests = False
+contest_index = None
+contest_index_lock = threading.RLock()
+# judges update their parts of the index concurrently, the shared lock only guards changes and saving
+contest_index_judge_locks = {online_judge: threading.Lock() for online_judge in online_judges}
+judge_timezones = {'atcoder': timezone(timedelta(hours=9))}
+# the first matching part of the lowercase contest name wins, rated ranges are inclusive and None is unbounded
+codeforces_divisions = [
+    ('div. 1 +', 'Div. 1 + Div. 2', [None, None]),
+    ('educational', 'Educational', [None, 2099]),
+    ('div. 1', 'Div. 1', [1900, None]),
+    ('div. 2', 'Div. 2', [None, 2099]),
+    ('div. 3', 'Div. 3', [None, 1599]),
+    ('div. 4', 'Div. 4', [None, 1399]),
+]
+atcoder_series = [('abc', 'AtCoder Beginner Contest'), ('arc', 'AtCoder Regular Contest'), ('agc', 'AtCoder Grand Contest'), ('ahc', 'AtCoder Heuristic Contest')]
+atcoder_archive_row_pattern = re.compile(r"<time class='fixtime fixtime-full'>([^<]+)</time>.*?<a href=\"/contests/([^\"/?]+)\">([^<]*)</a>.*?<td class=\"text-center\">\s*(\d+):(\d+)\s*</td>\s*<td class=\"text-center\">([^<]*)</td>", re.DOTALL)
+
+
+def make_contest(contest_id, name, start_time, end_time, division=None, number=None, rated_range=None, jid=None, finished=None):
+    return {
+        'id': contest_id,
+        'jid': jid,
+        'name': name,
+        'start_time': start_time,
+        'end_time': end_time,
+        'division': division,
+        'number': number,
+        'rated_range': rated_range,
+        'finished': finished,
+    }
+
+
+def fetch_codeforces_contests(known, updated_at):
+    # contest.list returns all contests at once, so there is nothing to page through
+    response = http_get('https://codeforces.com/api/contest.list?gym=false', use_cache=False, stream=True)
+    if response.status_code != 200:
+        raise StandingsError(f"{response.status_code}: can't download the list of codeforces contests")
+    contests = {}
+    with response:
+        for contest in iterate_json_items(response.raw, 'result.item'):
+            division, rated_range = None, None
+            for part, contest_division, contest_rated_range in codeforces_divisions:
+                if contest['name'].lower().find(part) != -1:
+                    division, rated_range = contest_division, contest_rated_range
+                    break
+            contest_id = str(contest['id'])
+            start_time = contest.get('startTimeSeconds')
+            end_time = start_time + contest['durationSeconds'] if start_time is not None else None
+            contests[contest_id] = make_contest(contest_id, contest['name'], start_time, end_time, division, rated_range=rated_range, finished=contest['phase'] == 'FINISHED')
+    return contests
+
+
+def fetch_paginated_contests(fetch_page, known, updated_at):
+    # pages go from the newest contests to the oldest ones, paging stops at the first page
+    # consisting of contests that had already ended when the index was updated last time
+    contests = {}
+    page = 1
+    while True:
+        page_contests = [contest for contest in fetch_page(page) if contest['id'] not in contests]
+        if not page_contests:
+            break
+        for contest in page_contests:
+            contests[contest['id']] = contest
+        if updated_at is not None and all(contest['id'] in known and contest['end_time'] is not None and contest['end_time'] < updated_at for contest in page_contests):
+            break
+        page += 1
+    return contests
+
+
+def parse_atcoder_rated_range(rated_range):
+    rated_range = rated_range.strip().replace('~', '-')
+    if rated_range == 'All':
+        return [None, None]
+    if rated_range.find('-') == -1 or rated_range == '-':
+        return None
+    low, _, high = rated_range.partition('-')
+    return [int(low) if low.strip() else None, int(high) if high.strip() else None]
+
+
+def fetch_atcoder_contests_page(page):
+    response = http_get(f'https://atcoder.jp/contests/archive?lang=en&page={page}', use_cache=False)
+    if response.status_code != 200:
+        raise StandingsError(f"{response.status_code}: can't download the list of atcoder contests")
+    contests = []
+    for row in response.text.split('<tr')[1:]:
+        match = atcoder_archive_row_pattern.search(row)
+        if match is None:
+            continue
+        start, contest_id, name, hours, minutes, rated_range = match.groups()
+        name = html.unescape(name)
+        start_time = int(datetime.strptime(start, '%Y-%m-%d %H:%M:%S%z').timestamp())
+        division, number = None, None
+        for prefix, series_name in atcoder_series:
+            id_match = re.fullmatch(prefix + r'(\d+)', contest_id)
+            name_match = re.search(series_name + r' (\d+)', name)
+            if id_match is not None or name_match is not None:
+                division = prefix.upper()
+                number = id_match.group(1) if id_match is not None else name_match.group(1)
+                break
+        contests.append(make_contest(contest_id, name, start_time, start_time + (int(hours) * 60 + int(minutes)) * 60, division, number, parse_atcoder_rated_range(rated_range)))
+    return contests
+
+
+def fetch_tlx_contests_page(page):
+    response = http_get(f'https://api.tlx.toki.id/v2/contests?page={page}', use_cache=False)
+    if response.status_code != 200:
+        raise StandingsError(f"{response.status_code}: can't download the list of tlx contests")
+    contests = []
+    for contest in response.json()['data']['page']:
+        division, number = None, None
+        slug_match = re.fullmatch(r'troc-(\d+)(?:-div-?(\d))?', contest['slug'])
+        if slug_match is not None:
+            number = slug_match.group(1)
+            if slug_match.group(2) is not None:
+                division = f'Div. {slug_match.group(2)}'
+        start_time = contest['beginTime'] // 1000
+        contests.append(make_contest(contest['slug'], contest.get('name', contest['slug']), start_time, (contest['beginTime'] + contest['duration']) // 1000, division, number, jid=contest['jid']))
+    return contests
+
+
+def fetch_contests(online_judge, known, updated_at):
+    if online_judge == 'codeforces':
+        return fetch_codeforces_contests(known, updated_at)
+    elif online_judge == 'atcoder':
+        return fetch_paginated_contests(fetch_atcoder_contests_page, known, updated_at)
+    elif online_judge == 'tlx':
+        return fetch_paginated_contests(fetch_tlx_contests_page, known, updated_at)
+    raise NotImplementedError
+
+
+def load_contest_index():
+    if os.path.isfile(contest_index_path):
+        with open(contest_index_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {'updated_at': {}, 'contests': {}}
+
+
+def save_contest_index(index):
+    os.makedirs(os.path.dirname(contest_index_path), exist_ok=True)
+    with open(contest_index_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(contest_index_path + '.tmp', contest_index_path)
+
+
+def update_contest_index(index, online_judge):
+    with contest_index_lock:
+        known = index['contests'].setdefault(online_judge, {})
+    updated_at = time.time()
+    with span('update_contest_index', online_judge=online_judge):
+        contests = fetch_contests(online_judge, known, index['updated_at'].get(online_judge))
+    with contest_index_lock:
+        known.update(contests)
+        index['updated_at'][online_judge] = updated_at
+        save_contest_index(index)
+    metrics.add('contests_indexed', len(contests), online_judge=online_judge)
+
+
+def get_contest_index():
+    global contest_index
+    if contest_index is None:
+        with contest_index_lock:
+            if contest_index is None:
+                index = load_contest_index()
+                if refresh_contests:
+                    for online_judge in online_judges:
+                        update_contest_index(index, online_judge)
+                contest_index = index
+    return contest_index
+
+
+def update_stale_contest_index(online_judge):
+    index = get_contest_index()
+    with contest_index_judge_locks[online_judge]:
+        updated_at = index['updated_at'].get(online_judge)
+        if updated_at is None or updated_at + contest_index_min_update_interval < time.time():
+            update_contest_index(index, online_judge)
+    return index
+
+
+def find_contest(online_judge, contest_id):
+    index = get_contest_index()
+    contest = index['contests'].get(online_judge, {}).get(contest_id)
+    if contest is None:
+        index = update_stale_contest_index(online_judge)
+        contest = index['contests'][online_judge].get(contest_id)
+    return contest
+
+
+def get_contest(online_judge, contest_id):
+    contest = find_contest(online_judge, contest_id)
+    if contest is None:
+        raise StandingsError(f"Can't find contest {contest_id} in the list of {online_judge} contests")
+    return contest
+
+
+def get_contest_start_date(online_judge, contest):
+    return datetime.fromtimestamp(contest['start_time'], judge_timezones.get(online_judge, timezone.utc)).strftime('%d.%m.%Y')
+
+
+def get_codeforces_rated_contestants(contest_id, refresh=False):
     url = f'https://codeforces.com/api/contest.ratingChanges?contestId={contest_id}'
-    response = requests.get(url)
+    response = http_get(url, stream=True, refresh=refresh)
     if response.status_code != 200:
-        print_failed_request_info(response)
-        print(response.json())
-        exit(1)
-    data = response.json()
+        raise StandingsError(get_failed_request_info(response))
+    handles = get_handles_by_judges()['codeforces']
     result = set()
-    for row in data['result']:
-        if row['handle'] in handles_by_judges['codeforces']:
-            result.add(row['handle'])
+    n_rows = 0
+    with response:
+        for row in iterate_json_items(response.raw, 'result.item'):
+            n_rows += 1
+            if row['handle'] in handles:
+                result.add(row['handle'])
+    if n_rows > 0:
+        cache_forever(url)
     return result
 
 
-def get_codeforces_standings(contest_id):
+def get_codeforces_standings(contest_id, refresh=False):
     url = f'https://codeforces.com/api/contest.standings?contestId={contest_id}&showUnofficial=true'
     url = compose_authorized_codeforces_request(url)
-    response = requests.get(url)
+    response = http_get(url, stream=True, refresh=refresh)
     if response.status_code != 200:
-        print_failed_request_info(response)
-        exit(1)
-    data = response.json()
-    standings = Standings('codeforces', contest_id, datetime.utcfromtimestamp(data['result']['contest']['startTimeSeconds']).strftime('%d.%m.%Y'))
-    if data['result']['contest']['name'].lower().find('educational') != -1:
-        rated_contestants = get_codeforces_rated_contestants(contest_id)
-    else:
-        rated_contestants = set(handles_by_judges['codeforces'].keys())
-    for row in data['result']['rows']:
-        if row['party']['participantType'] != 'OUT_OF_COMPETITION' and row['party']['participantType'] != 'CONTESTANT':
-            continue
-        members = row['party']['members']
-        handle = members[0]['handle']
-        if len(members) != 1 or handle not in handles_by_judges['codeforces']:
-            continue
-        user_group = 2
-        if handles_by_judges['codeforces'][handle].is_official:
-            if row['party']['participantType'] == 'CONTESTANT' and handle in rated_contestants:
-                user_group = 0
-            else:
-                user_group = 1
-        standings.add_result(handle, row['points'], row['penalty'], user_group)
-    return standings
-
-
-def get_atcoder_standings(contest_id):
-    def get_credentials():
-        if os.path.isfile('data/atcoder_credentials.txt'):
-            f = open('data/atcoder_credentials.txt', 'r')
-            credentials = f.read().split()
-            f.close()
-            if len(credentials) == 2:
-                return tuple(credentials)
-        username = input('Enter atcoder username: ')
-        from stdiomask import getpass
-        password = getpass(prompt='Enter atcoder password: ')
-        return username, password
-        
-    def save_credentials(username, password):
-        f = open('data/atcoder_credentials.txt', 'w')
-        print(username, password, file=f)
+        raise StandingsError(get_failed_request_info(response))
+    handles = get_handles_by_judges()['codeforces']
+    with response:
+        contest = read_json_item(response.raw, 'result.contest')
+        if contest['phase'] == 'FINISHED':
+            cache_forever(url)
+        start_date = datetime.utcfromtimestamp(contest['startTimeSeconds']).strftime('%d.%m.%Y')
+        if contest['name'].lower().find('educational') != -1:
+            rated_contestants = get_codeforces_rated_contestants(contest_id, refresh)
+        else:
+            rated_contestants = set(handles.keys())
+        response.raw.seek(0)
+        rows = []
+        for row in iterate_json_items(response.raw, 'result.rows.item'):
+            if row['party']['participantType'] != 'OUT_OF_COMPETITION' and row['party']['participantType'] != 'CONTESTANT':
+                continue
+            members = row['party']['members']
+            handle = members[0]['handle']
+            if len(members) != 1 or handle not in handles:
+                continue
+            user_group = 2
+            if handles[handle].is_official:
+                if row['party']['participantType'] == 'CONTESTANT' and handle in rated_contestants:
+                    user_group = 0
+                else:
+                    user_group = 1
+            rows.append((handle, row['points'], row['penalty'], user_group))
+    return Standings.from_rows('codeforces', contest_id, start_date, rows)
+
+
+def get_atcoder_credentials():
+    if os.path.isfile('data/atcoder_credentials.txt'):
+        f = open('data/atcoder_credentials.txt', 'r')
+        credentials = f.read().split()
         f.close()
+        if len(credentials) == 2:
+            return tuple(credentials)
+    username = input('Enter atcoder username: ')
+    from stdiomask import getpass
+    password = getpass(prompt='Enter atcoder password: ')
+    return username, password
 
-    def get_login_cookies(force):
-        if os.path.isfile('data/atcoder_cookies.json') and not force:
-            with open('data/atcoder_cookies.json', 'r') as f:
-                cookies = json.load(f)
-                return cookies
-        print('Login to the https://atcoder.jp, open developer console => Application => '
-              'Storage => Cookies => https://atcoder.jp => REVEL_SESSION => Cookie Value')
-        revel_session = input('Enter REVEL_SESSION cookie: ')
-        cookies = {
-            'REVEL_SESSION': revel_session
-        }
-        with open('data/atcoder_cookies.json', 'w') as f:
-            json.dump(cookies, f, indent=2)
-        return cookies
 
-    def no_captcha_login():
-        atcoder = onlinejudge.service.atcoder.AtCoderService()
-        while True:
-            try:
-                username, password = get_credentials()
-                atcoder.login(get_credentials=lambda username=username, password=password: (username, password))
-                save_credentials(username, password)
-                break
-            except onlinejudge.type.LoginError:
-                print('Incorrect username or password, try again')
-        session=onlinejudge.service.atcoder.utils.get_default_session()
-        return session
+def save_atcoder_credentials(username, password):
+    f = open('data/atcoder_credentials.txt', 'w')
+    print(username, password, file=f)
+    f.close()
 
-    def login():
-        should_force_enter_cookie = False
-        while True:
-            session = requests.session()
-            login_cookies = get_login_cookies(should_force_enter_cookie)
-            session.cookies.set('REVEL_SESSION', login_cookies['REVEL_SESSION'])
-            response = session.get('https://atcoder.jp/contests/abc444/standings/json', allow_redirects=False)
-            if response.status_code == 200:
-                break
-            print(f'Bad response, status code = {response.status_code}, try again.')
-            should_force_enter_cookie = True
-        return session
-
-    def get_contest_date(session, contest_id):
-        url = f'https://atcoder.jp/contests/{contest_id}'
-        response = session.get(url, allow_redirects=False).text
-        pos = response.find('<small class="contest-duration">')
-        pos = response.find('</time>', pos)
-        pos = response.rfind('>', 0, pos) + 1
-        year = response[pos:pos + 4]
-        month = response[pos + 5:pos + 7]
-        day = response[pos + 8:pos + 10]
-        return f'{day}.{month}.{year}'
-
-    def get_rated_range_max(contest_id):
-        if contest_id.find('abc') != -1:
-            return 2000
-        if contest_id.find('arc') != -1:
-            return 2800
-        return 10 ** 9
-
-    session = login()
-    start_date = get_contest_date(session, contest_id)
+
+def get_atcoder_login_cookies(force):
+    if os.path.isfile('data/atcoder_cookies.json') and not force:
+        with open('data/atcoder_cookies.json', 'r') as f:
+            cookies = json.load(f)
+            return cookies
+    print('Login to the https://atcoder.jp, open developer console => Application => '
+          'Storage => Cookies => https://atcoder.jp => REVEL_SESSION => Cookie Value')
+    revel_session = input('Enter REVEL_SESSION cookie: ')
+    cookies = {
+        'REVEL_SESSION': revel_session
+    }
+    with open('data/atcoder_cookies.json', 'w') as f:
+        json.dump(cookies, f, indent=2)
+    return cookies
+
+
+def atcoder_no_captcha_login():
+    import onlinejudge
+    atcoder = onlinejudge.service.atcoder.AtCoderService()
+    while True:
+        try:
+            username, password = get_atcoder_credentials()
+            atcoder.login(get_credentials=lambda username=username, password=password: (username, password))
+            save_atcoder_credentials(username, password)
+            break
+        except onlinejudge.type.LoginError:
+            print('Incorrect username or password, try again')
+    session=onlinejudge.service.atcoder.utils.get_default_session()
+    return session
+
+
+def atcoder_login():
+    should_force_enter_cookie = False
+    while True:
+        session = requests.session()
+        session.mount('https://', HTTPAdapter(pool_maxsize=http_pool_size))
+        login_cookies = get_atcoder_login_cookies(should_force_enter_cookie)
+        session.cookies.set('REVEL_SESSION', login_cookies['REVEL_SESSION'])
+        response = http_get('https://atcoder.jp/contests/abc444/standings/json', session, use_cache=False, allow_redirects=False)
+        if response.status_code == 200:
+            break
+        print(f'Bad response, status code = {response.status_code}, try again.')
+        should_force_enter_cookie = True
+    return session
+
+
+atcoder_session = None
+atcoder_session_lock = threading.Lock()
+
+
+def get_atcoder_session():
+    global atcoder_session
+    with atcoder_session_lock:
+        if atcoder_session is None:
+            atcoder_session = atcoder_login()
+        return atcoder_session
+
+
+def get_atcoder_standings(contest_id, refresh=False):
+    contest = get_contest('atcoder', contest_id)
+    session = get_atcoder_session()
     url = f'https://atcoder.jp/contests/{contest_id}/standings/json'
-    response = session.get(url, allow_redirects=False)
+    response = http_get(url, session, stream=True, refresh=refresh, allow_redirects=False)
     if response.status_code != 200:
-        print_failed_request_info(response)
-        exit(1)
-    data = response.json()
-    standings = Standings('atcoder', contest_id, start_date)
-    for row in data['StandingsData']:
-        if not row['IsRated'] and False:
-            continue
-        handle = row['UserScreenName']
-        if handle not in handles_by_judges['atcoder']:
-            continue
-        if not row['TotalResult']['Count']:
-            continue
-        points = row['TotalResult']['Score'] // 100
-        penalty = row['TotalResult']['Elapsed'] // 10 ** 9 + row['TotalResult']['Penalty'] * 5 * 60
-        user_group = 2
-        if handles_by_judges['atcoder'][handle].is_official:
-            if row['OldRating'] < get_rated_range_max(contest_id):
+        raise StandingsError(get_failed_request_info(response))
+    if contest['end_time'] + standings_final_delay < time.time():
+        cache_forever(url)
+    rating_limit = contest['rated_range'][1] if contest['rated_range'] is not None else None
+    handles = get_handles_by_judges()['atcoder']
+    rows = []
+    with response:
+        for row in iterate_json_items(response.raw, 'StandingsData.item'):
+            if not row['IsRated'] and False:
+                continue
+            handle = row['UserScreenName']
+            if handle not in handles:
+                continue
+            if not row['TotalResult']['Count']:
+                continue
+            points = row['TotalResult']['Score'] // 100
+            penalty = row['TotalResult']['Elapsed'] // 10 ** 9 + row['TotalResult']['Penalty'] * 5 * 60
+            user_group = 2
+            if handles[handle].is_official:
+                if rating_limit is None or row['OldRating'] <= rating_limit:
+                    user_group = 0
+                else:
+                    user_group = 1
+            rows.append((handle, points, penalty, user_group))
+    return Standings.from_rows('atcoder', contest_id, get_contest_start_date('atcoder', contest), rows)
+
+
+def get_tlx_scoreboard_url(contest_jid):
+    return f'https://api.tlx.toki.id/v2/contests/{contest_jid}/scoreboard?frozen=false&showClosedProblems=false'
+
+
+def get_tlx_standings(contest_id, refresh=False):
+    contest = get_contest('tlx', contest_id)
+    url = get_tlx_scoreboard_url(contest['jid'])
+    response = http_get(url, stream=True, refresh=refresh)
+    if response.status_code != 200:
+        raise StandingsError(get_failed_request_info(response))
+    if contest['end_time'] + standings_final_delay < time.time():
+        cache_forever(url)
+    handles = get_handles_by_judges()['tlx']
+    rows = []
+    with response:
+        for row in iterate_json_items(response.raw, 'data.scoreboard.content.entries.item'):
+            handle = row['contestantUsername']
+            if handle not in handles:
+                continue
+            user_group = 2
+            if handles[handle].is_official:
                 user_group = 0
+            rows.append((handle, row['totalPoints'], row['totalPenalties'], user_group))
+    return Standings.from_rows('tlx', contest_id, get_contest_start_date('tlx', contest), rows)
+
+
+def get_standings(online_judge, contest_id, refresh=False):
+    # refresh skips the cached response, final standings are cached forever but may still change
+    with span('get_standings', online_judge=online_judge):
+        if online_judge == 'codeforces':
+            return get_codeforces_standings(contest_id, refresh)
+        elif online_judge == 'atcoder':
+            return get_atcoder_standings(contest_id, refresh)
+        elif online_judge == 'tlx':
+            return get_tlx_standings(contest_id, refresh)
+        else:
+            raise NotImplementedError
+
+
+upload_format_version = 2
+upload_user_fields = ['name', 'codeforces_handle', 'atcoder_handle', 'tlx_handle', 'is_official']
+compress_uploads = True
+
+
+def encode_standings(standings, sheet_name, rows=None):
+    # rows are indices of the rows to send, all rows by default
+    user_ids = {}
+    encoded_users = []
+    standings.rank()
+    if rows is None:
+        rows = range(len(standings))
+    user_indices = []
+    for user in (standings.users[i] for i in rows):
+        handle = user.get_handle(standings.online_judge)
+        if handle not in user_ids:
+            user_ids[handle] = len(encoded_users)
+            encoded_users.append([getattr(user, field) for field in upload_user_fields])
+        user_indices.append(user_ids[handle])
+    results = {
+        'user': user_indices,
+        'place': [standings.place[i] for i in rows],
+        'points': [standings.points[i] for i in rows],
+        'penalty': [standings.penalty[i] for i in rows],
+        'user_group': [standings.user_group[i] for i in rows],
+    }
+    return {
+        'format': upload_format_version,
+        'action': 'add_standings',
+        'sheet_name': sheet_name,
+        'online_judge': standings.online_judge,
+        'contest_id': standings.contest_id,
+        'start_date': standings.start_date,
+        'n_participants': standings.n_participants,
+        'user_fields': upload_user_fields,
+        'users': encoded_users,
+        'results': results,
+    }
+
+
+def encode_ratings(online_judge, ratings):
+    return {
+        'format': upload_format_version,
+        'action': 'update_ratings',
+        'online_judge': online_judge,
+        'ratings': {field: [rating[field] for rating in ratings] for field in ['handle', 'old_rating', 'new_rating']},
+    }
+
+
+def encode_upload(data):
+    with span('encode', action=data['action']):
+        return encode_upload_body(data)
+
+
+def encode_upload_body(data):
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    if not compress_uploads:
+        return body.encode()
+    payload = base64.b64encode(gzip.compress(body.encode())).decode()
+    return json.dumps({'format': upload_format_version, 'encoding': 'gzip+base64', 'payload': payload}).encode()
+
+
+# doPost waits up to 30 seconds for the lock and apps script stops a run after 6 minutes
+upload_timeout = 6 * 60 + 30
+
+
+def send_to_spreadsheet(target, data, idempotency_key):
+    spreadsheet_app_id = target.read_file('spreadsheet_app_id.txt')
+    url = f'https://script.google.com/macros/s/{spreadsheet_app_id}/exec'
+    host = urlparse(url).hostname
+    body = encode_upload(data)
+    metrics.add('bytes_uploaded', len(body), host=host, target=target.name)
+    with span('post', host=host, action=data['action'], target=target.name):
+        response = get_session(host).post(url, params={'idempotency_key': idempotency_key}, data=body, headers={'Content-Type': 'application/json'}, timeout=upload_timeout)
+    print(f"{target}: {data['action']} {idempotency_key}: {response.status_code}")
+    return response
+
+
+# seconds a run waits at its end for the queued uploads, the rest is sent by the next run
+outbox_drain_timeout = 10 * 60
+# doPost answers with one of these once the upload is applied, apps script answers 200 with an error page when doPost throws
+upload_accepted_answers = {'ok', 'duplicate'}
+# an upload refused for good (a 4xx answer other than 429, like a wrong app id) is moved to the failed directory of the outbox,
+# other failures are retried until the spreadsheet accepts the upload, with delays of at most backoff_cap
+outbox_claim_suffix = '.sending'
+# a claim this old is left by a run which crashed while sending, a live run gives up on a request after upload_timeout
+outbox_claim_stale_after = 2 * upload_timeout
+
+
+class Outbox:
+    # payloads are written to disk before they are sent, a background thread posts them in order and
+    # deletes them once the spreadsheet accepted them; a resent payload keeps its idempotency key.
+    # every table has its own outbox, so the tables are posted to concurrently.
+    # the watch mode and a manual run may drain the same outbox, an entry is renamed to .sending while it is sent,
+    # so it is sent by one run only and it can't be coalesced away by another run in the meantime
+    def __init__(self, directory, target):
+        self.directory = directory
+        self.failed_directory = os.path.join(directory, 'failed')
+        self.target = target
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def get_entries(self):
+        # queued uploads, including the ones being sent by this or another run
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-len(outbox_claim_suffix)] if name.endswith(outbox_claim_suffix) else name
+                      for name in os.listdir(self.directory) if name.endswith('.json') or name.endswith('.json' + outbox_claim_suffix))
+
+    def get_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def load(self, name):
+        # None when the entry is claimed, or another run has sent or replaced it in the meantime
+        try:
+            with open(self.get_path(name), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def remove(self, name):
+        try:
+            os.remove(self.get_path(name))
+        except FileNotFoundError:
+            pass
+
+    def claim(self, name):
+        # the rename succeeds in one run only
+        try:
+            os.rename(self.get_path(name), self.get_path(name + outbox_claim_suffix))
+        except FileNotFoundError:
+            return False
+        # the rename keeps the time the entry was queued at, the claim is as old as the send
+        os.utime(self.get_path(name + outbox_claim_suffix))
+        return True
+
+    def unclaim(self, name):
+        try:
+            os.replace(self.get_path(name + outbox_claim_suffix), self.get_path(name))
+        except FileNotFoundError:
+            pass
+
+    def release_stale_claim(self, name):
+        try:
+            if os.path.getmtime(self.get_path(name + outbox_claim_suffix)) + outbox_claim_stale_after < time.time():
+                self.unclaim(name)
+        except FileNotFoundError:
+            pass
+
+    def put(self, data):
+        key = uuid.uuid4().hex
+        entry = {'key': key, 'created_at': time.time(), 'data': data}
+        path = os.path.join(self.directory, f'{time.time_ns():020d}-{key}.json')
+        os.makedirs(self.directory, exist_ok=True)
+        with self.condition:
+            if data['action'] == 'update_ratings':
+                self.coalesce({data['online_judge']})
+            elif data['action'] == 'update_all_ratings':
+                self.coalesce({update['online_judge'] for update in data['updates']})
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + '.tmp', path)
+            self.condition.notify_all()
+        self.start()
+        return key
+
+    def coalesce(self, updated_judges):
+        # a newer rating update of the judges replaces the queued ones it covers, unless a run is sending it right now
+        for name in self.get_entries():
+            entry = self.load(name)
+            if entry is None:
+                continue
+            data = entry['data']
+            if data['action'] == 'update_ratings' and data['online_judge'] in updated_judges:
+                self.remove(name)
+                metrics.add('uploads_coalesced', 1, online_judge=data['online_judge'], target=self.target.name)
+            elif data['action'] == 'update_all_ratings' and all(update['online_judge'] in updated_judges for update in data['updates']):
+                self.remove(name)
+                metrics.add('uploads_coalesced', 1, online_judge='all', target=self.target.name)
+
+    def start(self):
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def run(self):
+        attempt = 0
+        while True:
+            with self.condition:
+                entries = self.get_entries()
+                while not entries:
+                    self.condition.wait()
+                    entries = self.get_entries()
+                name = entries[0]
+                if not self.claim(name):
+                    # another run is sending the first upload, the uploads go in order
+                    self.release_stale_claim(name)
+                    self.condition.wait(run_lock_poll_interval)
+                    continue
+            entry = self.load(name + outbox_claim_suffix)
+            if entry is None:
+                continue
+            upload = f"{self.target}: {entry['data']['action']} {entry['key']}"
+            try:
+                response = send_to_spreadsheet(self.target, entry['data'], entry['key'])
+                accepted = response.status_code == 200 and response.text.strip() in upload_accepted_answers
+                refused = 400 <= response.status_code < 500 and response.status_code not in retryable_status_codes
+                if not accepted:
+                    print(f'{upload}: unexpected answer {response.text.strip()[:200]!r}')
+            except requests.RequestException as e:
+                # timeouts and dropped connections are retried
+                print(f'{upload}: {e}')
+                accepted, refused = False, False
+            failed = not accepted and refused
+            with self.condition:
+                if accepted:
+                    self.remove(name + outbox_claim_suffix)
+                elif failed:
+                    # later uploads are not held up by one which will never be accepted
+                    os.makedirs(self.failed_directory, exist_ok=True)
+                    os.replace(self.get_path(name + outbox_claim_suffix), os.path.join(self.failed_directory, name))
+                    print(f'{upload}: refused with status {response.status_code}, it is moved to {self.failed_directory}')
+                else:
+                    self.unclaim(name)
+                self.condition.notify_all()
+            if accepted or failed:
+                if failed:
+                    metrics.add('uploads_failed', 1, target=self.target.name)
+                attempt = 0
             else:
-                user_group = 1
-        standings.add_result(handle, points, penalty, user_group)
-    return standings
+                metrics.add('upload_retries', 1, target=self.target.name)
+                time.sleep(get_retry_delay(None, attempt))
+                # the delay stops growing at backoff_cap long before this
+                attempt = min(attempt + 1, 32)
 
+    def get_failed_entries(self):
+        if not os.path.isdir(self.failed_directory):
+            return []
+        return sorted(name for name in os.listdir(self.failed_directory) if name.endswith('.json'))
 
-def get_tlx_standings(contest_id):
-    def get_info(slug):
-        url = f'https://api.tlx.toki.id/v2/contests?page=1'
-        response = requests.get(url)
-        if response.status_code != 200:
-            print(f'{response.status_code}: something went wrong, try again')
-            exit(1)
-        data = response.json()
-        for contest in data['data']['page']:
-            if contest['slug'] == slug:
-                return contest['jid'], contest['beginTime'] // 1000
-        print(f"Can't find contest jid by slug: {slug}")
-        exit(1)
+    def wait(self, timeout):
+        # returns the number of uploads that are still queued, the watch mode may be sending them from its own process
+        deadline = time.time() + timeout
+        with self.condition:
+            while self.get_entries() and time.time() < deadline:
+                self.condition.wait(min(deadline - time.time(), run_lock_poll_interval))
+            return len(self.get_entries())
 
-    contest_jid, start_time = get_info(contest_id)
-    url = f'https://api.tlx.toki.id/v2/contests/{contest_jid}/scoreboard?frozen=false&showClosedProblems=false'
-    response = requests.get(url)
-    if response.status_code != 200:
-        print_failed_request_info(response)
-        exit(1)
-    data = response.json()
-    standings = Standings('tlx', contest_id, datetime.utcfromtimestamp(start_time).strftime('%d.%m.%Y'))
-    for row in data['data']['scoreboard']['content']['entries']:
-        handle = row['contestantUsername']
-        if handle not in handles_by_judges['tlx']:
-            continue
-        user_group = 2
-        if handles_by_judges['tlx'][handle].is_official:
-            user_group = 0
-        standings.add_result(handle, row['totalPoints'], row['totalPenalties'], user_group)
-    return standings
 
+def post_to_spreadsheet(target, data):
+    # returns at once, the payload is safe on disk and is uploaded in the background
+    return target.outbox.put(data)
 
-def get_standings(online_judge, contest_id):
-    if online_judge == 'codeforces':
-        return get_codeforces_standings(contest_id)
-    elif online_judge == 'atcoder':
-        return get_atcoder_standings(contest_id)
-    elif online_judge == 'tlx':
-        return get_tlx_standings(contest_id)
-    else:
-        raise NotImplementedError
+
+def start_outboxes():
+    # uploads left by an earlier run
+    for target in get_targets():
+        if target.outbox.get_entries():
+            target.outbox.start()
+
+
+def flush_outbox(timeout=outbox_drain_timeout):
+    waiting = [target for target in get_targets() if target.outbox.get_entries()]
+    if waiting:
+        print('Waiting for the uploads to the spreadsheet...')
+    deadline = time.time() + timeout
+    for target in waiting:
+        target.outbox.start()
+    for target in waiting:
+        n_left = target.outbox.wait(max(0, deadline - time.time()))
+        if n_left > 0:
+            print(f'{n_left} uploads are left in {target.outbox.directory}, they will be sent by the next run')
+    for target in get_targets():
+        n_failed = len(target.outbox.get_failed_entries())
+        if n_failed > 0:
+            print(f'{n_failed} uploads failed and are kept in {target.outbox.failed_directory}, move them back to {target.outbox.directory} to send them again')
+
+
+posted_standings_lock = threading.Lock()
+
+
+def get_contest_key(online_judge, contest_id):
+    return f'{online_judge}/{contest_id}'
+
+
+def load_posted_standings(target):
+    if os.path.isfile(target.posted_standings_path):
+        with open(target.posted_standings_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+
+def load_all_posted_standings():
+    # contests posted to any of the tables
+    posted = {}
+    for target in get_targets():
+        posted.update(load_posted_standings(target))
+    return posted
+
+
+def record_posted_standings(target, standings, sheet_name):
+    with posted_standings_lock:
+        posted = load_posted_standings(target)
+        posted[get_contest_key(standings.online_judge, standings.contest_id)] = {'sheet_name': sheet_name, 'posted_at': time.time()}
+        os.makedirs(target.directory, exist_ok=True)
+        with open(target.posted_standings_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(posted, f, ensure_ascii=False, indent=2)
+        os.replace(target.posted_standings_path + '.tmp', target.posted_standings_path)
+
+
+store_results = True
+
+
+def get_target_standings(standings, target):
+    # standings are fetched once for the participants of all tables, every table gets its own participants;
+    # a user who is unofficial in this table but official in another one goes to the last group
+    handles = target.get_handles_by_judges()[standings.online_judge]
+    standings.rank()
+    rows = []
+    for user, points, penalty, user_group in zip(standings.users, standings.points, standings.penalty, standings.user_group):
+        target_user = handles.get(user.get_handle(standings.online_judge))
+        if target_user is not None:
+            rows.append((target_user, points, penalty, user_group if target_user.is_official else 2))
+    return Standings.from_user_rows(standings.online_judge, standings.contest_id, standings.start_date, rows)
+
+
+def store_standings(target, standings, sheet_name):
+    if not store_results:
+        return
+    standings.rank()
+    online_judge = standings.online_judge
+    results = [(user.get_handle(online_judge), user.name, user.codeforces_handle, user.atcoder_handle, user.tlx_handle, user.is_official, place, points, penalty, user_group)
+               for user, place, points, penalty, user_group in zip(standings.users, standings.place, standings.points, standings.penalty, standings.user_group)]
+    with span('store', online_judge=online_judge, target=target.name), results_store.opened(target.store_path) as connection:
+        results_store.save_standings(connection, online_judge, standings.contest_id, sheet_name, standings.start_date, results)
+
+
+def load_stored_standings(target, online_judge, contest_id):
+    with results_store.opened(target.store_path) as connection:
+        contests = results_store.find_contests(connection, get_contest_key(online_judge, contest_id))
+        if not contests:
+            raise StandingsError(f"Can't find {get_contest_key(online_judge, contest_id)} in the local store of {target}")
+        rows = results_store.load_results(connection, online_judge, contest_id)
+    users = {}
+    for row in rows:
+        if row['handle'] not in users:
+            users[row['handle']] = User(row['name'], row['codeforces_handle'], row['atcoder_handle'], row['tlx_handle'], bool(row['is_official']))
+    standings = Standings.from_user_rows(online_judge, contest_id, contests[0]['start_date'], ((users[row['handle']], row['points'], row['penalty'], row['user_group']) for row in rows))
+    return contests[0]['sheet_name'], standings
+
+
+def repost_standings(keys):
+    # rebuilds sheets from the local store, the online judges are not contacted;
+    # a sheet is written from scratch or created again if it was deleted, the main table keeps the column of the contest
+    for target in get_targets():
+        for key in keys:
+            with results_store.opened(target.store_path) as connection:
+                contests = results_store.find_contests(connection, key)
+            if not contests:
+                print(f'{target}: {key}: not found in the local store')
+                continue
+            for contest in contests:
+                sheet_name, standings = load_stored_standings(target, contest['online_judge'], contest['contest_id'])
+                print(f"{target}: reposting {contest['online_judge']}/{contest['contest_id']} \"{sheet_name}\"")
+                data = encode_standings(standings, sheet_name)
+                data['action'] = 'rebuild_standings'
+                post_to_spreadsheet(target, data)
+                record_posted_standings(target, standings, sheet_name)
+
+
+def get_winner_points(standings):
+    # the points of the first row of every group, like getWinnerPoints in the spreadsheet
+    standings.rank()
+    return [standings.points[standings.group_starts[group]] if standings.n_participants[group] > 0 else -1 for group in range(standings.n_user_groups)]
+
+
+def diff_standings(old_standings, new_standings):
+    # rows of the sheet are positional, so a row has to be rewritten when anything shown in it changes,
+    # including the rating, which depends on the winner points and the number of participants of its group
+    old_standings.rank()
+    new_standings.rank()
+    online_judge = new_standings.online_judge
+
+    def get_row(standings, i):
+        user = standings.users[i]
+        return tuple(getattr(user, field) for field in upload_user_fields) + (standings.place[i], standings.points[i], standings.penalty[i], standings.user_group[i])
+
+    old_winner_points, new_winner_points = get_winner_points(old_standings), get_winner_points(new_standings)
+    changed_groups = {group for group in range(new_standings.n_user_groups)
+                      if old_winner_points[group] != new_winner_points[group] or old_standings.n_participants[group] != new_standings.n_participants[group]}
+    changed_rows = [i for i in range(len(new_standings))
+                    if i >= len(old_standings) or new_standings.user_group[i] in changed_groups or get_row(new_standings, i) != get_row(old_standings, i)]
+    # cells of the main table reference the rows of the sheet, so they change with the rows of their users
+    old_rows = {user.get_handle(online_judge): i for i, user in enumerate(old_standings.users)}
+    new_rows = {user.get_handle(online_judge): i for i, user in enumerate(new_standings.users)}
+    moved_handles = sorted(handle for handle in old_rows.keys() | new_rows.keys() if old_rows.get(handle) != new_rows.get(handle))
+    return changed_rows, [(handle, new_rows.get(handle, -1)) for handle in moved_handles]
+
+
+def encode_standings_diff(old_standings, new_standings, sheet_name, changed_rows, moved_handles):
+    data = encode_standings(new_standings, sheet_name, changed_rows)
+    data['action'] = 'refresh_standings'
+    data['results']['row'] = changed_rows
+    data['n_rows'] = len(new_standings)
+    data['old_n_rows'] = len(old_standings)
+    data['winner_points'] = get_winner_points(new_standings)
+    data['main_table'] = {
+        'handle': [handle for handle, _ in moved_handles],
+        'row': [row for _, row in moved_handles],
+    }
+    return data
+
+
+def refresh_standings(keys):
+    # fetches contests again and sends only the rows that differ from the stored ones,
+    # a contest stored in several tables is fetched once
+    fetched = {}
+    for target in get_targets():
+        for key in keys:
+            with results_store.opened(target.store_path) as connection:
+                contests = results_store.find_contests(connection, key)
+            if not contests:
+                print(f'{target}: {key}: not found in the local store, create the standings first')
+                continue
+            for contest in contests:
+                online_judge, contest_id = contest['online_judge'], contest['contest_id']
+                contest_key = get_contest_key(online_judge, contest_id)
+                sheet_name, old_standings = load_stored_standings(target, online_judge, contest_id)
+                if contest_key not in fetched:
+                    if online_judge == 'atcoder':
+                        get_atcoder_session()
+                    fetched[contest_key] = get_standings(online_judge, contest_id, refresh=True)
+                new_standings = get_target_standings(fetched[contest_key], target)
+                changed_rows, moved_handles = diff_standings(old_standings, new_standings)
+                removed_rows = max(0, len(old_standings) - len(new_standings))
+                print(f'{target}: {contest_key} "{sheet_name}": {len(changed_rows)} rows changed, {removed_rows} removed, {len(moved_handles)} cells of the main table')
+                if not changed_rows and not removed_rows and not moved_handles:
+                    continue
+                store_standings(target, new_standings, sheet_name)
+                post_to_spreadsheet(target, encode_standings_diff(old_standings, new_standings, sheet_name, changed_rows, moved_handles))
+                record_posted_standings(target, new_standings, sheet_name)
 
 
 def post_standings(standings, sheet_name):
+    # posts the standings to every table which has participants in them, returns the keys of the queued uploads
     print(standings)
-    if standings.empty():
-        print('Standings are empty')
-        return
-    spreadsheet_app_id = open('data/spreadsheet_app_id.txt', 'r').read()
-    url = f'https://script.google.com/macros/s/{spreadsheet_app_id}/exec'
-    data = jsonpickle.decode(jsonpickle.encode(standings, unpicklable=False))
-    data['sheet_name'] = sheet_name
-    data['action'] = 'add_standings'
-    response = requests.post(url, json=data)
-    print(response.status_code)
+    keys = []
+    for target in get_targets():
+        target_standings = get_target_standings(standings, target)
+        store_standings(target, target_standings, sheet_name)
+        if target_standings.empty():
+            print(f'Standings are empty in {target}')
+            continue
+        keys.append(post_to_spreadsheet(target, encode_standings(target_standings, sheet_name)))
+        record_posted_standings(target, target_standings, sheet_name)
+    return keys
 
 
 def create_standings(online_judge, contest_id, sheet_name):
@@ -337,6 +1609,67 @@ def create_standings(online_judge, contest_id, sheet_name):
     post_standings(standings, sheet_name)
 
 
+def read_standings_list(filename):
+    # every line is a contest id, optionally followed by the sheet name in quotes; the sheet name is None when it is not given
+    contests = []
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.strip()
+            assert len(line.split()) >= 1, f'wrong-formatted line: {line}'
+            if len(line.split()) == 1:
+                contest_id = line
+                sheet_name = None
+            elif len(line.split()) >= 2:
+                contest_id, *sheet_name = line.split()
+                sheet_name = ' '.join(sheet_name)
+                assert sheet_name[0] == '"' and sheet_name[-1] == '"', f'wrong-formatted line: {line}'
+                sheet_name = sheet_name[1:-1]
+            contests.append((contest_id, sheet_name))
+    return contests
+
+
+def resolve_listed_contest(contest_id, sheet_name):
+    # the judge is None for a contest which is in no contest list, the sheet name is '' when it is not given and can't be made up
+    online_judge = find_online_judge(contest_id)
+    if online_judge is None:
+        return None, ''
+    if sheet_name is None:
+        sheet_name = get_sheet_name(contest_id)
+    return online_judge, sheet_name
+
+
+def create_standings_from_list(filename, n_workers=default_n_workers):
+    # a contest which can't be posted is reported in the summary, the other contests are posted anyway
+    contests = []
+    for contest_id, sheet_name in read_standings_list(filename):
+        try:
+            online_judge, sheet_name = resolve_listed_contest(contest_id, sheet_name)
+            status = 'unknown contest' if online_judge is None else 'no sheet name' if sheet_name == '' else None
+        except Exception as e:
+            online_judge, status = None, f'failed: {e}'
+        contests.append((online_judge, contest_id, sheet_name, status))
+    if any(online_judge == 'atcoder' and status is None for online_judge, _, _, status in contests):
+        get_atcoder_session()
+    report = []
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(profiled(get_standings), online_judge, contest_id) if status is None else None for online_judge, contest_id, _, status in contests]
+        for (online_judge, contest_id, sheet_name, status), future in zip(contests, futures):
+            print(online_judge, contest_id, sheet_name)
+            if future is None:
+                print(status)
+            else:
+                try:
+                    status = 'queued' if post_standings(future.result(), sheet_name) else 'empty'
+                except Exception as e:
+                    status = f'failed: {e}'
+                    print(status)
+            report.append((online_judge, contest_id, sheet_name, status))
+    print('Summary:')
+    for online_judge, contest_id, sheet_name, status in report:
+        print(f'{online_judge or "?"}/{contest_id} "{sheet_name}": {status}')
+    return report
+
+
 def read_option(prompt, options, case_sensetive=False):
     option = input(prompt)
     if not case_sensetive:
@@ -359,27 +1692,36 @@ def read_date(prompt):
             print('Date should be in format dd.mm.yyyy')
 
 
+def find_online_judge(contest_id):
+    # None when the contest is in none of the contest lists
+    if contest_id.isdigit():
+        return 'codeforces'
+    for online_judge in ['atcoder', 'tlx']:
+        if find_contest(online_judge, contest_id) is not None:
+            return online_judge
+    return None
+
+
 def guess_online_judge(contest_id):
-    if contest_id[:3] in ['abc', 'arc', 'agc']:
-        return 'atcoder'
-    if contest_id.find('troc') != -1:
-        return 'tlx'
-    return 'codeforces'
+    return find_online_judge(contest_id) or 'codeforces'
 
 
 def get_sheet_name(contest_id):
     online_judge = guess_online_judge(contest_id)
-    if online_judge == 'atcoder':
-        return f'{contest_id[:3].upper()} #{contest_id[3:]}'
-    elif online_judge == 'tlx':
-        division = ''
-        contest_number = contest_id
-        if contest_number.find('div') != -1:
-            division = f' (Div. {contest_number[-1]})'
-            contest_number = contest_number[:-6]
-        return f'TROC #{contest_number[5:]}{division}'
-    else:
+    if online_judge == 'codeforces':
         return ''
+    return get_contest_sheet_name(online_judge, find_contest(online_judge, contest_id))
+
+
+def get_contest_sheet_name(online_judge, contest):
+    if online_judge == 'codeforces':
+        return contest['name']
+    if contest['number'] is None:
+        return ''
+    if online_judge == 'atcoder':
+        return f"{contest['division']} #{contest['number']}"
+    division = f" ({contest['division']})" if contest['division'] is not None else ''
+    return f"TROC #{contest['number']}{division}"
 
 
 def create_standings_from_user_answers():
@@ -389,139 +1731,584 @@ def create_standings_from_user_answers():
     if sheet_name == '':
         sheet_name = input('Enter sheet name: ')
     if read_option(f'Create standings "{sheet_name}" with data from {online_judge}/{contest_id}? (yes/no) ', ['y', 'n', 'yes', 'no'])[0] == 'y':
-        create_standings(online_judge, contest_id, sheet_name)
+        try:
+            create_standings(online_judge, contest_id, sheet_name)
+        except StandingsError as e:
+            print(e)
+            exit(1)
 
 
-def update_ratings(online_judge, start_date, C_platform, D_platform):
-    def get_contest_history_url(online_judge, handle):
-        if online_judge == 'codeforces':
-            return f'https://codeforces.com/api/user.rating?handle={handle}'
-        elif online_judge == 'atcoder':
-            return f'https://atcoder.jp/users/{handle}/history/json'
-        elif online_judge == 'tlx':
-            return f'https://api.tlx.toki.id/v2/contest-history/public?username={handle}'
+C_platforms = {
+    'codeforces': 10,
+    'atcoder': 10,
+    'tlx': 5,
+}
+D_platforms = {
+    'codeforces': 200,
+    'atcoder': 150,
+    'tlx': 200,
+}
+rating_history_path = 'data/rating_history.json'
+rating_history_lock = threading.Lock()
+# rating changes of a contest are looked for during this many seconds after its end, later the contest is considered unrated
+rating_changes_max_delay = 3 * 24 * 60 * 60
+full_rating_sync = False
+
+
+def get_contest_history_url(online_judge, handle):
+    if online_judge == 'codeforces':
+        return f'https://codeforces.com/api/user.rating?handle={handle}'
+    elif online_judge == 'atcoder':
+        return f'https://atcoder.jp/users/{handle}/history/json'
+    elif online_judge == 'tlx':
+        return f'https://api.tlx.toki.id/v2/contest-history/public?username={handle}'
+    raise NotImplementedError
+
+
+def get_atcoder_history_timestamp(end_time):
+    return datetime.strptime(end_time[:10], '%Y-%m-%d').timestamp()
+
+
+def parse_contest_history(online_judge, data):
+    # every entry is [contest key, timestamp, new rating], the contest key is the contest id or the tlx jid
+    history = []
+    if online_judge == 'codeforces':
+        for row in data['result']:
+            history.append([str(row['contestId']), row['ratingUpdateTimeSeconds'], row['newRating']])
+    elif online_judge == 'atcoder':
+        for row in data:
+            history.append([row['ContestScreenName'].split('.')[0], get_atcoder_history_timestamp(row['EndTime']), row['NewRating']])
+    elif online_judge == 'tlx':
+        for row in data['data']:
+            timestamp = data['contestsMap'][row['contestJid']]['beginTime'] // 1000
+            if row.get('rating') is None:
+                continue
+            try:
+                new_rating = row['rating']['publicRating']
+            except Exception as e:
+                new_rating = 0
+            history.append([row['contestJid'], timestamp, new_rating])
+    return history
+
+
+def fetch_contest_history(online_judge, handle, use_cache=True):
+    response = http_get(get_contest_history_url(online_judge, handle), use_cache=use_cache)
+    if response.status_code != 200:
+        print(f'Something went wrong for {handle}, status code = {response.status_code}')
+        print(f'Response text: {response.text}')
+        return None
+    with span('json_decode', online_judge=online_judge):
+        data = response.json()
+    return parse_contest_history(online_judge, data)
+
+
+def fetch_contest_rating_changes(online_judge, contest):
+    # returns history entries of the roster members by handle, None if the rating changes are not published yet
+    if online_judge == 'codeforces':
+        url = f"https://codeforces.com/api/contest.ratingChanges?contestId={contest['id']}"
+        prefix = 'result.item'
+    elif online_judge == 'atcoder':
+        url = f"https://atcoder.jp/contests/{contest['id']}/results/json"
+        prefix = 'item'
+    else:
         raise NotImplementedError
-        
-    def contest_history_iterator(online_judge, data):
-        if online_judge == 'codeforces':
-            for row in data['result']:
-                yield row['ratingUpdateTimeSeconds'], row['newRating']
-        elif online_judge == 'atcoder':
-            for row in data:
-                timestamp = datetime.strptime(row['EndTime'][:10], '%Y-%m-%d').timestamp()
-                yield timestamp, row['NewRating']
-        elif online_judge == 'tlx':
-            for row in data['data']:
-                timestamp = data['contestsMap'][row['contestJid']]['beginTime'] // 1000
-                if row.get('rating') is None:
-                    continue
-                try:
-                    new_rating = row['rating']['publicRating']
-                except Exception as e:
-                    new_rating = 0
-                yield timestamp, new_rating
-                
+    response = http_get(url, use_cache=False, stream=True)
+    if response.status_code == 400 and online_judge == 'codeforces':
+        # codeforces answers "Rating changes are unavailable for this contest" for unrated contests
+        response.close()
+        return {}
+    if response.status_code != 200:
+        print(f"Can't get rating changes of {online_judge}/{contest['id']}, status code = {response.status_code}")
+        response.close()
+        return None
+    handles = get_handles_by_judges()[online_judge]
+    changes = {}
+    n_rows = 0
+    with response:
+        for row in iterate_json_items(response.raw, prefix):
+            n_rows += 1
+            if online_judge == 'codeforces' and row['handle'] in handles:
+                changes[row['handle']] = [str(row['contestId']), row['ratingUpdateTimeSeconds'], row['newRating']]
+            elif online_judge == 'atcoder' and row['IsRated'] and row['UserScreenName'] in handles:
+                changes[row['UserScreenName']] = [contest['id'], get_atcoder_history_timestamp(row['EndTime']), row['NewRating']]
+    if n_rows == 0:
+        return None
+    return changes
+
+
+def get_tlx_contest_participants(contest):
+    response = http_get(get_tlx_scoreboard_url(contest['jid']), stream=True)
+    if response.status_code != 200:
+        print(f"Can't get the scoreboard of tlx/{contest['id']}, status code = {response.status_code}")
+        response.close()
+        return None
+    handles = get_handles_by_judges()['tlx']
+    with response:
+        return {row['contestantUsername'] for row in iterate_json_items(response.raw, 'data.scoreboard.content.entries.item') if row['contestantUsername'] in handles}
+
+
+def load_rating_histories():
+    if os.path.isfile(rating_history_path):
+        with open(rating_history_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+
+def save_rating_histories(store):
+    os.makedirs(os.path.dirname(rating_history_path), exist_ok=True)
+    with open(rating_history_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(store, f, ensure_ascii=False)
+    os.replace(rating_history_path + '.tmp', rating_history_path)
+
+
+def sync_rating_histories(online_judge, n_workers=default_n_workers):
+    # brings the local rating histories of the roster up to date and returns the store of the judge;
+    # the first sync downloads every history, later ones only look at contests finished since the last sync
+    from tqdm import tqdm
+    store = load_rating_histories()
+    judge_store = store.setdefault(online_judge, {'synced_at': None, 'synced_contests': {}, 'histories': {}})
+    histories = judge_store['histories']
+    synced_contests = judge_store['synced_contests']
+    handles = list(get_handles_by_judges()[online_judge])
+    now = time.time()
+    candidates = []
+    if full_rating_sync or judge_store['synced_at'] is None:
+        refetch = list(handles)
+    else:
+        refetch = [handle for handle in handles if handle not in histories]
+        index = update_stale_contest_index(online_judge)
+        since = judge_store['synced_at'] - rating_changes_max_delay
+        candidates = sorted((contest for contest in index['contests'][online_judge].values()
+                             if contest['end_time'] is not None and since < contest['end_time'] <= now and contest['id'] not in synced_contests), key=lambda contest: contest['end_time'])
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        if online_judge == 'tlx':
+            # tlx has no rating changes by contest, so the participants of new contests download their histories again
+            participants = list(executor.map(profiled(get_tlx_contest_participants), candidates))
+            active = sorted({handle for contest_participants in participants if contest_participants is not None for handle in contest_participants} - set(refetch))
+            changes = None
+        else:
+            changes = list(executor.map(profiled(lambda contest: fetch_contest_rating_changes(online_judge, contest)), candidates))
+            active = []
+        fetched = list(tqdm(executor.map(profiled(lambda handle: fetch_contest_history(online_judge, handle, use_cache=handle not in active)), refetch + active), total=len(refetch) + len(active)))
+    for handle, history in zip(refetch + active, fetched):
+        if history is not None:
+            histories[handle] = history
+    for i, contest in enumerate(candidates):
+        if changes is not None:
+            published = changes[i] is not None
+            for handle, entry in (changes[i] or {}).items():
+                if handle in histories and all(key != entry[0] for key, _, _ in histories[handle]):
+                    histories[handle].append(entry)
+                    histories[handle].sort(key=lambda entry: entry[1])
+        else:
+            published = participants[i] is not None and all(handle in histories and any(key == contest['jid'] for key, _, _ in histories[handle]) for handle in participants[i])
+        if published or contest['end_time'] + rating_changes_max_delay < now:
+            synced_contests[contest['id']] = contest['end_time']
+    print(f'{online_judge}: {len(candidates)} new contests, {len(refetch) + len(active)} histories downloaded')
+    judge_store['synced_at'] = now
+    judge_store['synced_contests'] = {contest_id: end_time for contest_id, end_time in synced_contests.items() if end_time > now - rating_changes_max_delay}
+    with rating_history_lock:
+        # other judges may have been synced at the same time, their parts of the file are kept
+        store = load_rating_histories()
+        store[online_judge] = judge_store
+        save_rating_histories(store)
+    return judge_store
+
+
+def get_rating_from_history(history, start_timestamp, C_platform, D_platform):
+    old_last_rating, old_max_rating, current_rating = 0, 0, 0
+    new_ratings = []
+    cnt_rated = 0
+    for _, timestamp, new_rating in history:
+        if timestamp < start_timestamp:
+            old_last_rating = new_rating
+            old_max_rating = max(old_max_rating, new_rating)
+        elif current_rating != new_rating:
+            new_ratings.append(new_rating)
+        if cnt_rated < C_platform:
+            old_max_rating = max(old_max_rating, new_rating)
+        cnt_rated += current_rating != new_rating
+        current_rating = new_rating
+    if len(new_ratings) == 0:
+        new_ratings.append(current_rating)
+    return max(old_max_rating - D_platform, old_last_rating), max(new_ratings[-((len(new_ratings) + 3) // 4):])
+
+
+def update_ratings(online_judge, start_date, C_platform, D_platform, n_workers=default_n_workers):
+    histories = sync_rating_histories(online_judge, n_workers)['histories']
+    return post_ratings(online_judge, histories, start_date, C_platform, D_platform)
+
+
+def compute_ratings(online_judge, histories, start_date, C_platform, D_platform):
+    # ratings of the participants of all tables by handle
     start_timestamp = start_date.timestamp()
-    wait_time = 5
-    ratings = []
-    for user in tqdm(users):
-        handle = user.get_handle(online_judge)
-        if handle == '':
+    computed = {}
+    for handle in get_handles_by_judges()[online_judge]:
+        if handle not in histories:
             continue
-        while True:
-            url = get_contest_history_url(online_judge, handle)
-            response = requests.get(url)
-            if response.status_code == 503:
-                time.sleep(wait_time)
-                continue
-            if response.status_code != 200:
-                print(f'Something went wrong, status code = {response.status_code}')
-                print(f'Response text: {response.text}')
-                time.sleep(wait_time)
-                print('Trying to repeat query')
-                continue
-            data = response.json()
-            old_last_rating, old_max_rating, current_rating = 0, 0, 0
-            new_ratings = []
-            cnt_rated = 0
-            for timestamp, new_rating in contest_history_iterator(online_judge, data):
-                if timestamp < start_timestamp:
-                    old_last_rating = new_rating
-                    old_max_rating = max(old_max_rating, new_rating)
-                elif current_rating != new_rating:
-                    new_ratings.append(new_rating)
-                if cnt_rated < C_platform:
-                    old_max_rating = max(old_max_rating, new_rating)
-                cnt_rated += current_rating != new_rating
-                current_rating = new_rating
-            if len(new_ratings) == 0:
-                new_ratings.append(current_rating)
-            ratings.append({
-                'handle': handle,
-                'old_rating': max(old_max_rating - D_platform, old_last_rating),
-                'new_rating': max(new_ratings[-((len(new_ratings) + 3) // 4):])
-            })
-            break
-    print(*ratings, sep='\n')
-    data = {
-        'ratings': ratings,
-        'action': 'update_ratings',
-        'online_judge': online_judge
-    }
-    spreadsheet_app_id = open('data/spreadsheet_app_id.txt', 'r').read()
-    url = f'https://script.google.com/macros/s/{spreadsheet_app_id}/exec'
-    response = requests.post(url, json=data)
-    print(response.status_code)
+        old_rating, new_rating = get_rating_from_history(histories[handle], start_timestamp, C_platform, D_platform)
+        computed[handle] = {
+            'handle': handle,
+            'old_rating': old_rating,
+            'new_rating': new_rating,
+        }
+    return computed
 
 
-def update_ratings_from_user_answers():
-    C = {
-        'codeforces': 10,
-        'atcoder': 10,
-        'tlx': 5,
-    }
-    D = {
-        'codeforces': 200,
-        'atcoder': 150,
-        'tlx': 200,
-    }
+def get_target_ratings(target, online_judge, computed):
+    return [computed[user.get_handle(online_judge)] for user in target.get_users() if user.get_handle(online_judge) in computed]
+
+
+def store_ratings(target, online_judge, start_date, C_platform, D_platform, ratings):
+    if not store_results:
+        return
+    with span('store', online_judge=online_judge, target=target.name), results_store.opened(target.store_path) as connection:
+        results_store.save_ratings(connection, online_judge, start_date.strftime('%d.%m.%Y'), C_platform, D_platform, ratings)
+
+
+def post_ratings(online_judge, histories, start_date, C_platform, D_platform):
+    # ratings are computed once for the participants of all tables and posted to every table, returns the keys of the queued uploads
+    computed = compute_ratings(online_judge, histories, start_date, C_platform, D_platform)
+    keys = []
+    for target in get_targets():
+        ratings = get_target_ratings(target, online_judge, computed)
+        if len(get_targets()) > 1:
+            print(f'{target}:')
+        print(*ratings, sep='\n')
+        store_ratings(target, online_judge, start_date, C_platform, D_platform, ratings)
+        keys.append(post_to_spreadsheet(target, encode_ratings(online_judge, ratings)))
+    return keys
+
+
+def update_ratings_from_user_answers(n_workers=default_n_workers):
     online_judge = read_option(f'Select online judge ({", ".join(online_judges[:-1])} or {online_judges[-1]}): ', online_judges)
     start_date = read_date('Enter start date (dd.mm.yyyy) for rating calculation: ')
-    update_ratings(online_judge, start_date, C[online_judge], D[online_judge])
+    update_ratings(online_judge, start_date, C_platforms[online_judge], D_platforms[online_judge], n_workers)
 
 
-online_judges = ['codeforces', 'atcoder', 'tlx']
-users = load_users()
-handles_by_judges = {
-    online_judge: {user.get_handle(online_judge) : user for user in users if user.get_handle(online_judge) != ''} for online_judge in online_judges
+rating_settings_name = 'rating_settings.json'
+
+
+def load_rating_settings(target):
+    # rating_settings.json next to the files of the table, used by -r --all and the watch mode, for example
+    # {"codeforces": {"start_date": "01.09.2024", "C": 10, "D": 200}, "atcoder": {"start_date": "01.09.2024"}, "tlx": {"start_date": "01.09.2024"}},
+    # C and D default to C_platforms and D_platforms
+    path = os.path.join(target.directory, rating_settings_name)
+    if not os.path.isfile(path):
+        raise ValueError(f'{path} is missing, it holds the start date of the rating calculation of every online judge')
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    settings = {}
+    for online_judge in online_judges:
+        judge_config = config.get(online_judge, {})
+        if 'start_date' not in judge_config:
+            raise ValueError(f'{path}: start_date of {online_judge} is missing')
+        try:
+            start_date = datetime.strptime(judge_config['start_date'], '%d.%m.%Y')
+        except ValueError:
+            raise ValueError(f'{path}: start_date of {online_judge} should be in format dd.mm.yyyy')
+        settings[online_judge] = (start_date, judge_config.get('C', C_platforms[online_judge]), judge_config.get('D', D_platforms[online_judge]))
+    return settings
+
+
+def load_all_rating_settings():
+    try:
+        return {target.name: load_rating_settings(target) for target in get_targets()}
+    except ValueError as e:
+        print(e)
+        exit(1)
+
+
+def compute_target_ratings(target, online_judge, histories, settings, computed):
+    # settings come from load_all_rating_settings, computed keeps the ratings of all participants for the tables with the same settings
+    start_date, C_platform, D_platform = settings[target.name][online_judge]
+    if (online_judge, start_date, C_platform, D_platform) not in computed:
+        computed[online_judge, start_date, C_platform, D_platform] = compute_ratings(online_judge, histories, start_date, C_platform, D_platform)
+    ratings = get_target_ratings(target, online_judge, computed[online_judge, start_date, C_platform, D_platform])
+    print(f"{target}: {online_judge}: {len(ratings)} ratings, start date {start_date.strftime('%d.%m.%Y')}, C = {C_platform}, D = {D_platform}")
+    store_ratings(target, online_judge, start_date, C_platform, D_platform, ratings)
+    return ratings
+
+
+def encode_all_ratings(updates):
+    return {
+        'format': upload_format_version,
+        'action': 'update_all_ratings',
+        'updates': updates,
+    }
+
+
+def update_all_ratings(n_workers=default_n_workers):
+    # the judges are independent hosts with their own rate limits, so their histories are synced in parallel
+    # and the run takes about as long as the slowest judge; every table gets one upload with the ratings of all judges
+    settings = load_all_rating_settings()
+    get_handles_by_judges()
+    with ThreadPoolExecutor(max_workers=len(online_judges)) as executor:
+        judge_stores = list(executor.map(profiled(lambda online_judge: sync_rating_histories(online_judge, n_workers)), online_judges))
+    computed = {}
+    keys = []
+    for target in get_targets():
+        updates = [encode_ratings(online_judge, compute_target_ratings(target, online_judge, judge_store['histories'], settings, computed)) for online_judge, judge_store in zip(online_judges, judge_stores)]
+        keys.append(post_to_spreadsheet(target, encode_all_ratings(updates)))
+    return keys
+
+
+watch_state_path = 'data/watch_state.json'
+watch_interval = 10 * 60
+# contests of these divisions are ingested by the watch mode, tlx contests are ingested when they are TROC rounds
+watched_divisions = {
+    'codeforces': ['Div. 1', 'Div. 2', 'Div. 1 + Div. 2', 'Div. 3', 'Educational'],
+    'atcoder': ['ABC', 'ARC', 'AGC'],
 }
-import argparse
-parser = argparse.ArgumentParser()
-parser.add_argument('-s', '--standings', action='store_true', help='perform action of adding standings')
-parser.add_argument('-r', '--rating', action='store_true', help='perform action of adding ratings')
-parser.add_argument('-l', '--list_standings', type=str, help='filename with list of standings to add')
-args = parser.parse_args()
-if args.standings:
-    if args.list_standings is not None:
-        with open(args.list_standings, 'r') as f:
-            for line in f:
-                line = line.strip()
-                assert len(line.split()) >= 1, f'wrong-formatted line: {line}'
-                if len(line.split()) == 1:
-                    contest_id = line
-                    online_judge = guess_online_judge(contest_id)
-                    sheet_name = get_sheet_name(contest_id)
-                    assert sheet_name != '', f'wrong-formatted line: {line}'
-                elif len(line.split()) >= 2:
-                    contest_id, *sheet_name = line.split()
-                    sheet_name = ' '.join(sheet_name)
-                    assert sheet_name[0] == '"' and sheet_name[-1] == '"', f'wrong-formatted line: {line}'
-                    sheet_name = sheet_name[1:-1]
-                    online_judge = guess_online_judge(contest_id)
-                    assert online_judge == 'codeforces', f'wrong-formatted line: {line}'
-                print(online_judge, contest_id, sheet_name)
-                create_standings(online_judge, contest_id, sheet_name)
+
+
+def is_watched_contest(online_judge, contest):
+    if online_judge == 'tlx':
+        return contest['number'] is not None
+    return contest['division'] in watched_divisions[online_judge]
+
+
+def is_contest_finished(contest, now):
+    # codeforces reports when system testing is over, other judges are done at the end of the contest
+    if contest.get('finished') is not None:
+        return contest['finished']
+    return contest['end_time'] is not None and contest['end_time'] <= now
+
+
+def depends_on_rating_changes(online_judge, contest):
+    # only the rated participants of educational codeforces rounds are official, they are known once the rating changes are published
+    return online_judge == 'codeforces' and contest['name'].lower().find('educational') != -1
+
+
+def get_watched_contests(online_judge, since, now):
+    index = update_stale_contest_index(online_judge)
+    contests = [contest for contest in index['contests'][online_judge].values()
+                if contest['start_time'] is not None and contest['start_time'] >= since and is_watched_contest(online_judge, contest) and is_contest_finished(contest, now)]
+    return sorted(contests, key=lambda contest: contest['end_time'])
+
+
+def load_watch_state(since):
+    if os.path.isfile(watch_state_path):
+        with open(watch_state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
     else:
-        create_standings_from_user_answers()
-elif args.rating:
-    update_ratings_from_user_answers()
\ No newline at end of file
+        state = {'since': time.time(), 'skipped': {}, 'rated': {}}
+    if since is not None:
+        state['since'] = since.timestamp()
+    return state
+
+
+def save_watch_state(state):
+    os.makedirs(os.path.dirname(watch_state_path), exist_ok=True)
+    with open(watch_state_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(watch_state_path + '.tmp', watch_state_path)
+
+
+def watch_judge(online_judge, state, settings, n_workers):
+    now = time.time()
+    contests = get_watched_contests(online_judge, state['since'], now)
+    posted = load_all_posted_standings()
+    new_contests = [contest for contest in contests if get_contest_key(online_judge, contest['id']) not in posted and get_contest_key(online_judge, contest['id']) not in state['skipped']]
+    # such contests are posted after their rating changes, or as they are once the rating changes are not expected anymore
+    waiting = [contest for contest in new_contests if depends_on_rating_changes(online_judge, contest) and contest['end_time'] + rating_changes_max_delay >= now
+               and fetch_contest_rating_changes(online_judge, contest) is None]
+    if waiting:
+        print(f'{online_judge}: waiting for rating changes of {len(waiting)} contests to post their standings')
+        new_contests = [contest for contest in new_contests if contest not in waiting]
+    if new_contests:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            # the rated contestants may have been cached before the rating changes were published
+            futures = [executor.submit(profiled(get_standings), online_judge, contest['id'], depends_on_rating_changes(online_judge, contest)) for contest in new_contests]
+            for contest, future in zip(new_contests, futures):
+                key = get_contest_key(online_judge, contest['id'])
+                print(f'New finished contest {key}: {contest["name"]}')
+                try:
+                    if not post_standings(future.result(), get_contest_sheet_name(online_judge, contest)):
+                        state['skipped'][key] = 'empty'
+                except Exception as e:
+                    print(f'{key}: failed: {e}')
+        posted = load_all_posted_standings()
+    # ratings are posted once the rating changes of every newly posted contest are known
+    pending = [contest for contest in contests if get_contest_key(online_judge, contest['id']) in posted and get_contest_key(online_judge, contest['id']) not in state['rated']]
+    if not pending:
+        return
+    judge_store = sync_rating_histories(online_judge, n_workers)
+    published = [contest for contest in pending if contest['id'] in judge_store['synced_contests'] or contest['end_time'] + rating_changes_max_delay < now]
+    if not published:
+        print(f'{online_judge}: waiting for rating changes of {len(pending)} contests')
+        return
+    # the rating window starts at the start date of the season from rating_settings.json, not at the start of the watch
+    computed = {}
+    for target in get_targets():
+        post_to_spreadsheet(target, encode_ratings(online_judge, compute_target_ratings(target, online_judge, judge_store['histories'], settings, computed)))
+    for contest in published:
+        state['rated'][get_contest_key(online_judge, contest['id'])] = now
+
+
+def watch(interval=watch_interval, since=None, n_workers=default_n_workers):
+    settings = load_all_rating_settings()
+    state = load_watch_state(since)
+    save_watch_state(state)
+    print(f"Watching contests that started after {datetime.fromtimestamp(state['since']).strftime('%d.%m.%Y %H:%M')}, every {interval} seconds")
+    get_atcoder_session()
+    while True:
+        # manual runs go between the polls
+        with run_lock():
+            for online_judge in online_judges:
+                try:
+                    with span('watch', online_judge=online_judge):
+                        watch_judge(online_judge, state, settings, n_workers)
+                except Exception as e:
+                    print(f'{online_judge}: watch failed: {e}')
+                save_watch_state(state)
+        time.sleep(interval)
+
+
+run_lock_path = 'data/run.lock'
+# a lock which was not touched for this many seconds is left by a crashed run, the holder touches it while it is alive
+run_lock_stale_after = 60 * 60
+run_lock_poll_interval = 5
+
+
+@contextlib.contextmanager
+def run_lock():
+    # keeps runs on this machine from changing the local state and posting the same contests at the same time;
+    # a run waits while another one holds the lock, the watch mode only holds it during its polls
+    os.makedirs(os.path.dirname(run_lock_path), exist_ok=True)
+    waiting = False
+    while True:
+        try:
+            fd = os.open(run_lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                age = time.time() - os.path.getmtime(run_lock_path)
+                with open(run_lock_path, 'r') as f:
+                    owner = f.read().strip()
+            except OSError:
+                continue
+            if age >= run_lock_stale_after:
+                os.remove(run_lock_path)
+                continue
+            if not waiting:
+                print(f'Waiting for another run ({owner}) to finish, remove {run_lock_path} if it is not running')
+                waiting = True
+            time.sleep(run_lock_poll_interval)
+    with os.fdopen(fd, 'w') as f:
+        f.write(f'pid {os.getpid()}, started at {datetime.now().strftime("%d.%m.%Y %H:%M:%S")}')
+    released = threading.Event()
+
+    def touch_lock():
+        while not released.wait(run_lock_stale_after / 4):
+            os.utime(run_lock_path)
+
+    threading.Thread(target=touch_lock, daemon=True).start()
+    try:
+        yield
+    finally:
+        released.set()
+        os.remove(run_lock_path)
+
+
+def main():
+    global cache_mode, refresh_roster, refresh_contests, full_rating_sync, compress_uploads, store_results, selected_targets
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--standings', action='store_true', help='perform action of adding standings')
+    parser.add_argument('-r', '--rating', action='store_true', help='perform action of adding ratings')
+    parser.add_argument('--all', action='store_true', help='with -r, update the ratings of all online judges at once, with the start dates from rating_settings.json')
+    parser.add_argument('-w', '--watch', action='store_true', help='keep running, ingest standings and ratings of contests as they finish')
+    parser.add_argument('--repost', type=str, nargs='+', help='post standings again from the local store, by sheet name or online_judge/contest_id')
+    parser.add_argument('-u', '--update-standings', type=str, nargs='+', help='fetch stored contests again and send only the changed rows, by sheet name or online_judge/contest_id')
+    parser.add_argument('-l', '--list_standings', type=str, help='filename with list of standings to add')
+    parser.add_argument('--no-cache', action='store_true', help='do not read or write the local response cache')
+    parser.add_argument('--refresh', action='store_true', help='download everything again and update the local response cache')
+    parser.add_argument('--refresh-roster', action='store_true', help='load the participants list from the spreadsheet even if the local copy is fresh')
+    parser.add_argument('--interval', type=int, default=watch_interval, help='seconds between polls of the contest lists in the watch mode')
+    parser.add_argument('--since', type=lambda date: datetime.strptime(date, '%d.%m.%Y'), help='contests that started before this date (dd.mm.yyyy) are ignored by the watch mode, the rating start dates are in rating_settings.json')
+    parser.add_argument('--refresh-contests', action='store_true', help='update the local list of contests of all online judges before using it')
+    parser.add_argument('--full-sync', action='store_true', help='download the rating histories of all users instead of the rating changes of new contests')
+    parser.add_argument('-t', '--targets', type=str, nargs='+', help=f'names of the tables in {targets_directory} to post to, all of them by default')
+    parser.add_argument('--no-store', action='store_true', help='do not save standings and ratings to the local store')
+    parser.add_argument('--no-gzip', action='store_true', help='send uploads to the spreadsheet as plain json')
+    parser.add_argument('-j', '--jobs', type=int, default=default_n_workers, help='number of concurrent requests to the online judges')
+    parser.add_argument('--metrics', type=str, help='file to write timings of all stages to, Prometheus textfile if it ends with .prom, json otherwise, - for stdout')
+    parser.add_argument('--profile', action='store_true', help='run under cProfile and tracemalloc and print the hot spots')
+    args = parser.parse_args()
+    if args.all and not args.rating:
+        parser.error('--all is used with -r')
+    if args.no_cache:
+        cache_mode = 'off'
+    elif args.refresh:
+        cache_mode = 'refresh'
+    refresh_roster = args.refresh_roster or args.refresh
+    refresh_contests = args.refresh_contests
+    full_rating_sync = args.full_sync
+    compress_uploads = not args.no_gzip
+    store_results = not args.no_store
+    selected_targets = args.targets
+    try:
+        get_targets()
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        if args.profile:
+            run_profiled(args)
+        else:
+            run(args)
+    finally:
+        if args.metrics is not None:
+            metrics.write(args.metrics)
+
+
+def run(args):
+    with span('run'):
+        # uploads left by an earlier run go first, a run without an action only sends them
+        start_outboxes()
+        if args.watch:
+            watch(args.interval, args.since, args.jobs)
+        elif args.repost is not None or args.update_standings is not None or args.standings or args.rating:
+            with run_lock():
+                if args.repost is not None:
+                    repost_standings(args.repost)
+                elif args.update_standings is not None:
+                    refresh_standings(args.update_standings)
+                elif args.standings:
+                    if args.list_standings is not None:
+                        create_standings_from_list(args.list_standings, args.jobs)
+                    else:
+                        create_standings_from_user_answers()
+                elif args.rating:
+                    if args.all:
+                        update_all_ratings(args.jobs)
+                    else:
+                        update_ratings_from_user_answers(args.jobs)
+        flush_outbox()
+
+
+def run_profiled(args, n_top=25):
+    global profilers
+    import pstats
+    import tracemalloc
+    profilers = []
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(run, args)
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stats = pstats.Stats(profiler)
+        for thread_profiler in profilers:
+            stats.add(thread_profiler)
+        profilers = None
+        print(f'Top {n_top} functions by cumulative time (all threads):')
+        stats.sort_stats('cumulative').print_stats(n_top)
+        print(f'Peak traced memory: {peak / 1024 / 1024:.1f} MB, top {n_top} allocations by line:')
+        for statistic in snapshot.statistics('lineno')[:n_top]:
+            print(statistic)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+import csv
+import time
+import argparse
+import itertools
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+
+import main
+
+
+config_table_name = 'ConfigV2'
+# the same order as the nested IF/SEARCH chain of getRatingCoefficientFormula, coefficients are in ConfigV2!B2:B9
+rating_coefficient_keys = ['AGC', 'ARC', 'ABC', 'Div. 1 + Div. 2', 'Div. 1', 'Div. 2', 'Div. 3', 'TROC']
+
+
+def load_rating_coefficients(target):
+    spreadsheet_id = target.read_file('spreadsheet_id.txt')
+    google_api_key = open(main.google_api_key_path, 'r').read()
+    url = f'https://sheets.googleapis.com/v4/spreadsheets/{spreadsheet_id}/values/{config_table_name}!B2:B9?valueRenderOption=UNFORMATTED_VALUE&key={google_api_key}'
+    values = main.http_get(url, use_cache=False).json()['values']
+    return {key: float(row[0]) if row else 0.0 for key, row in zip(rating_coefficient_keys, values)}
+
+
+def get_rating_coefficient(sheet_name, coefficients):
+    for key in rating_coefficient_keys:
+        if sheet_name.lower().find(key.lower()) != -1:
+            return coefficients.get(key, 0.0)
+    return 0.0
+
+
+def round_like_to_fixed(values, digits=2):
+    # Number.prototype.toFixed rounds the exact binary value and resolves ties upwards,
+    # np.round resolves ties to even, so values lying on a tie are rounded with Decimal
+    scale = 10 ** digits
+    rounded = np.round(values, digits)
+    scaled = values * scale
+    ties = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    quantum = Decimal(1).scaleb(-digits)
+    for i in ties:
+        rounded[i] = float(Decimal(float(values[i])).quantize(quantum, rounding=ROUND_HALF_UP))
+    return rounded
+
+
+def get_itmo_ratings(points, places, user_groups, n_participants):
+    points = np.asarray(points, dtype=np.float64)
+    places = np.asarray(places, dtype=np.float64)
+    user_groups = np.asarray(user_groups, dtype=np.int64)
+    n_participants = np.asarray(n_participants, dtype=np.float64)
+    # winnerPoints in createStandings are the points of the first row of every group
+    winner_points = np.full(len(n_participants), -1.0)
+    groups, first_rows = np.unique(user_groups, return_index=True)
+    winner_points[groups] = points[first_rows]
+    max_points = winner_points[user_groups]
+    participants = n_participants[user_groups]
+    n = np.maximum(participants, 10)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratings = np.minimum(100, 50 * points / max_points * (2 * n - 2) / (n + places - 2))
+    ratings = np.where(participants == 1, 100.0, ratings)
+    ratings = np.where(max_points == 0, 0.0, ratings)
+    return round_like_to_fixed(ratings)
+
+
+class SeasonRating:
+    def __init__(self, users, sheet_names, scores, totals, places):
+        self.users = users
+        self.sheet_names = sheet_names
+        self.scores = scores
+        self.totals = totals
+        self.places = places
+
+    def ranking(self):
+        order = np.argsort(-self.totals, kind='stable')
+        return [(self.places[i], self.users[i], float(self.totals[i])) for i in order]
+
+    def __str__(self):
+        return '\n'.join(f'{place}) {user.name}: {total:.2f}' for place, user, total in self.ranking())
+
+
+def compute_season_rating(users, contests, coefficients):
+    # contests is a list of (sheet_name, standings) in the order of the main table columns
+    user_ids = {id(user): i for i, user in enumerate(users)}
+    scores = np.zeros((len(users), len(contests)))
+    for j, (sheet_name, standings) in enumerate(contests):
+        standings.rank()
+        if len(standings) == 0:
+            continue
+        ratings = get_itmo_ratings(np.frombuffer(standings.points, dtype=np.float64), np.frombuffer(standings.place, dtype=np.int64), np.frombuffer(standings.user_group, dtype=np.int8), standings.n_participants)
+        rows = np.array([user_ids.get(id(user), -1) for user in standings.users])
+        known = rows != -1
+        scores[rows[known], j] = get_rating_coefficient(sheet_name, coefficients) * ratings[known]
+    # the total column of the main table sums the contest columns from left to right
+    totals = np.zeros(len(users))
+    for j in range(len(contests)):
+        totals += scores[:, j]
+    order = np.argsort(-totals, kind='stable')
+    places = ['-'] * len(users)
+    current_place = 0
+    for i in order:
+        if users[i].is_official:
+            current_place += 1
+            places[i] = current_place
+    return SeasonRating(users, [sheet_name for sheet_name, _ in contests], scores, totals, places)
+
+
+def pad_histories(histories):
+    # histories are lists of [contest key, timestamp, new rating] sorted by time
+    n_users = len(histories)
+    length = max([len(history) for history in histories] + [1])
+    timestamps = np.full((n_users, length), np.inf)
+    ratings = np.zeros((n_users, length))
+    lengths = np.zeros(n_users, dtype=np.int64)
+    for i, history in enumerate(histories):
+        lengths[i] = len(history)
+        if history:
+            timestamps[i, :len(history)] = [timestamp for _, timestamp, _ in history]
+            ratings[i, :len(history)] = [rating for _, _, rating in history]
+    return timestamps, ratings, lengths
+
+
+def sweep_ratings(histories, C_values, D_values, start_timestamps):
+    # the rules of main.get_rating_from_history for all users and all combinations at once,
+    # returns old and new ratings shaped (users, C, D, start) and (users, start)
+    timestamps, ratings, lengths = pad_histories(histories)
+    n_users, length = ratings.shape
+    valid = np.arange(length)[None, :] < lengths[:, None]
+    previous = np.concatenate([np.zeros((n_users, 1)), ratings[:, :-1]], axis=1)
+    changed = valid & (ratings != previous)
+    # prefix_max[u, j] is the maximum of 0 and the first j ratings
+    prefix_max = np.concatenate([np.zeros((n_users, 1)), np.maximum.accumulate(np.where(valid, ratings, 0), axis=1)], axis=1)
+    users = np.arange(n_users)[:, None]
+    # the number of entries before every start, entries before it are a prefix of the history
+    n_before = (timestamps[:, :, None] < np.asarray(start_timestamps, dtype=np.float64)[None, None, :]).sum(axis=1)
+    old_last = np.where(n_before > 0, ratings[users, np.maximum(n_before - 1, 0)], 0)
+    # the first C changes also count to the old maximum, entries with fewer earlier changes than C are a prefix too
+    changes_before = np.cumsum(changed, axis=1) - changed
+    n_first = ((changes_before[:, :, None] < np.asarray(C_values)[None, None, :]) & valid[:, :, None]).sum(axis=1)
+    old_max = prefix_max[users[:, :, None], np.maximum(n_first[:, :, None], n_before[:, None, :])]
+    old_ratings = np.maximum(old_max[:, :, None, :] - np.asarray(D_values, dtype=np.float64)[None, None, :, None], old_last[:, None, None, :])
+    # changes after the start are a suffix of all changes, so the top quarter of them is a suffix as well
+    n_changes = changed.sum(axis=1)
+    changed_prefix = np.concatenate([np.zeros((n_users, 1), dtype=np.int64), np.cumsum(changed, axis=1)], axis=1)
+    n_new = n_changes[:, None] - changed_prefix[users, n_before]
+    order = np.argsort(~changed, axis=1, kind='stable')
+    changed_ratings = np.where(np.arange(length)[None, :] < n_changes[:, None], ratings[users, order], -np.inf)
+    # suffix_max[u, q] is the maximum of the last q changes
+    reversed_positions = n_changes[:, None] - 1 - np.arange(length)[None, :]
+    reversed_ratings = np.where(reversed_positions >= 0, changed_ratings[users, np.maximum(reversed_positions, 0)], -np.inf)
+    suffix_max = np.concatenate([np.full((n_users, 1), -np.inf), np.maximum.accumulate(reversed_ratings, axis=1)], axis=1)
+    current = np.where(lengths > 0, ratings[np.arange(n_users), np.maximum(lengths - 1, 0)], 0)
+    new_ratings = np.where(n_new > 0, suffix_max[users, np.minimum((n_new + 3) // 4, length)], current[:, None])
+    return old_ratings, new_ratings
+
+
+def get_places(values):
+    # places by decreasing value, equal values share the place
+    order = np.argsort(-values, kind='stable')
+    places = np.empty(len(values), dtype=np.int64)
+    sorted_values = values[order]
+    first = np.concatenate([[True], sorted_values[1:] != sorted_values[:-1]])
+    places[order] = np.maximum.accumulate(np.where(first, np.arange(len(values)), 0)) + 1
+    return places
+
+
+def run_sweep(online_judge, C_values, D_values, start_dates, output=None, sync=False, n_workers=main.default_n_workers):
+    if sync:
+        histories = main.sync_rating_histories(online_judge, n_workers)['histories']
+    else:
+        histories = main.load_rating_histories().get(online_judge, {}).get('histories', {})
+    if not histories:
+        print(f'No stored rating histories of {online_judge}, run with --sync first')
+        return
+    handles = sorted(histories)
+    user_histories = [histories[handle] for handle in handles]
+    start_time = time.perf_counter()
+    old_ratings, new_ratings = sweep_ratings(user_histories, C_values, D_values, [start_date.timestamp() for start_date in start_dates])
+    deltas = new_ratings[:, None, None, :] - old_ratings
+    # ranking changes are relative to the current C and D of the judge with the first start date
+    baseline_old, baseline_new = sweep_ratings(user_histories, [main.C_platforms[online_judge]], [main.D_platforms[online_judge]], [start_dates[0].timestamp()])
+    baseline_places = get_places(baseline_new[:, 0] - baseline_old[:, 0, 0, 0])
+    print(f'{len(handles)} users, {deltas[0].size} combinations, computed in {time.perf_counter() - start_time:.3f} s')
+    rows = []
+    for (c, C_platform), (d, D_platform), (s, start_date) in itertools.product(enumerate(C_values), enumerate(D_values), enumerate(start_dates)):
+        delta = deltas[:, c, d, s]
+        places = get_places(delta)
+        moves = np.abs(places - baseline_places)
+        print(f"C = {C_platform}, D = {D_platform}, start = {start_date.strftime('%d.%m.%Y')}: mean delta {delta.mean():.1f}, median {np.median(delta):.1f}, "
+              f'{int((delta > 0).sum())} improved, {int((moves > 0).sum())} ranks changed, max move {int(moves.max())}')
+        if output is not None:
+            for i, handle in enumerate(handles):
+                rows.append([C_platform, D_platform, start_date.strftime('%d.%m.%Y'), handle, int(old_ratings[i, c, d, s]), int(new_ratings[i, s]), int(delta[i]), int(places[i]), int(baseline_places[i] - places[i])])
+    if output is not None:
+        with open(output, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['C', 'D', 'start_date', 'handle', 'old_rating', 'new_rating', 'delta', 'place', 'place_change'])
+            writer.writerows(rows)
+        print(f'Results are written to {output}')
+
+
+def main_cli():
+    def read_date(date):
+        return datetime.strptime(date, '%d.%m.%Y')
+
+    parser = argparse.ArgumentParser(description='compute the season rating locally, without the spreadsheet')
+    parser.add_argument('-l', '--list_standings', type=str, help='filename with list of standings of the season')
+    parser.add_argument('-j', '--jobs', type=int, default=main.default_n_workers, help='number of concurrent requests to the online judges')
+    parser.add_argument('-t', '--target', type=str, help=f'name of the table in {main.targets_directory} whose participants are rated, the first one by default')
+    parser.add_argument('--from-store', action='store_true', help='take the standings from the local store instead of the online judges')
+    parser.add_argument('--sweep', choices=main.online_judges, help='evaluate old and new ratings of the online judge for every combination of --C, --D and --start-dates')
+    parser.add_argument('--C', type=int, nargs='+', help='values of C to sweep, the current one by default')
+    parser.add_argument('--D', type=int, nargs='+', help='values of D to sweep, the current one by default')
+    parser.add_argument('--start-dates', type=read_date, nargs='+', help='start dates (dd.mm.yyyy) to sweep')
+    parser.add_argument('--sync', action='store_true', help='bring the stored rating histories up to date before the sweep')
+    parser.add_argument('-o', '--output', type=str, help='csv file for the ratings of every user in every combination')
+    args = parser.parse_args()
+    if args.sweep is not None:
+        if not args.start_dates:
+            parser.error('--sweep requires --start-dates')
+        C_values = args.C or [main.C_platforms[args.sweep]]
+        D_values = args.D or [main.D_platforms[args.sweep]]
+        run_sweep(args.sweep, C_values, D_values, args.start_dates, args.output, args.sync, args.jobs)
+        return
+    if args.list_standings is None:
+        parser.error('either -l or --sweep is required')
+    try:
+        target = main.get_target(args.target)
+    except ValueError as e:
+        parser.error(str(e))
+    contests = []
+    for contest_id, sheet_name in main.read_standings_list(args.list_standings):
+        online_judge, sheet_name = main.resolve_listed_contest(contest_id, sheet_name)
+        if online_judge is None or sheet_name == '':
+            print(f'{contest_id}: unknown contest or no sheet name, it is left out of the season rating')
+            continue
+        contests.append((online_judge, contest_id, sheet_name))
+    if args.from_store:
+        # stored rows have their own users, the season rating matches them to the participants list by handle
+        standings = [main.get_target_standings(main.load_stored_standings(target, online_judge, contest_id)[1], target) for online_judge, contest_id, _ in contests]
+    else:
+        if any(online_judge == 'atcoder' for online_judge, _, _ in contests):
+            main.get_atcoder_session()
+        with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            standings = list(executor.map(lambda contest: main.get_target_standings(main.get_standings(contest[0], contest[1]), target), contests))
+    season_rating = compute_season_rating(target.get_users(), [(sheet_name, contest_standings) for (_, _, sheet_name), contest_standings in zip(contests, standings)], load_rating_coefficients(target))
+    print(season_rating)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,191 @@
+import os
+import time
+import sqlite3
+import argparse
+import contextlib
+from datetime import datetime
+
+
+store_path = 'data/results.sqlite'
+# day columns are yyyy-mm-dd, so that date ranges are index range scans
+schema = '''
+CREATE TABLE IF NOT EXISTS contests (
+    online_judge TEXT NOT NULL,
+    contest_id TEXT NOT NULL,
+    sheet_name TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    day TEXT NOT NULL,
+    stored_at REAL NOT NULL,
+    PRIMARY KEY (online_judge, contest_id)
+);
+CREATE INDEX IF NOT EXISTS contests_by_day ON contests (day);
+CREATE INDEX IF NOT EXISTS contests_by_sheet_name ON contests (sheet_name);
+CREATE TABLE IF NOT EXISTS results (
+    online_judge TEXT NOT NULL,
+    contest_id TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    handle TEXT NOT NULL,
+    name TEXT NOT NULL,
+    codeforces_handle TEXT NOT NULL,
+    atcoder_handle TEXT NOT NULL,
+    tlx_handle TEXT NOT NULL,
+    is_official INTEGER NOT NULL,
+    place INTEGER NOT NULL,
+    points REAL NOT NULL,
+    penalty INTEGER NOT NULL,
+    user_group INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    PRIMARY KEY (online_judge, contest_id, row)
+);
+CREATE INDEX IF NOT EXISTS results_by_name ON results (name, day);
+CREATE INDEX IF NOT EXISTS results_by_handle ON results (handle, day);
+CREATE TABLE IF NOT EXISTS ratings (
+    online_judge TEXT NOT NULL,
+    handle TEXT NOT NULL,
+    computed_at REAL NOT NULL,
+    start_date TEXT NOT NULL,
+    C_platform INTEGER NOT NULL,
+    D_platform INTEGER NOT NULL,
+    old_rating INTEGER NOT NULL,
+    new_rating INTEGER NOT NULL,
+    PRIMARY KEY (online_judge, handle, computed_at)
+);
+CREATE INDEX IF NOT EXISTS ratings_by_time ON ratings (computed_at);
+'''
+result_columns = ['handle', 'name', 'codeforces_handle', 'atcoder_handle', 'tlx_handle', 'is_official', 'place', 'points', 'penalty', 'user_group']
+
+
+def connect(path=store_path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.row_factory = sqlite3.Row
+    # the watch mode writes while other runs read
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.executescript(schema)
+    return connection
+
+
+@contextlib.contextmanager
+def opened(path=store_path):
+    with contextlib.closing(connect(path)) as connection:
+        yield connection
+
+
+def get_day(date):
+    # dd.mm.yyyy as used in the sheets
+    return datetime.strptime(date, '%d.%m.%Y').strftime('%Y-%m-%d')
+
+
+def save_standings(connection, online_judge, contest_id, sheet_name, start_date, results):
+    # results are tuples in the order of result_columns, a contest stored again replaces the old rows
+    day = get_day(start_date)
+    with connection:
+        connection.execute('DELETE FROM results WHERE online_judge = ? AND contest_id = ?', (online_judge, contest_id))
+        connection.execute('INSERT OR REPLACE INTO contests VALUES (?, ?, ?, ?, ?, ?)', (online_judge, contest_id, sheet_name, start_date, day, time.time()))
+        connection.executemany(f'INSERT INTO results VALUES (?, ?, ?, {", ".join("?" for _ in result_columns)}, ?)',
+                               ((online_judge, contest_id, row, *result, day) for row, result in enumerate(results)))
+
+
+def save_ratings(connection, online_judge, start_date, C_platform, D_platform, ratings):
+    computed_at = time.time()
+    with connection:
+        connection.executemany('INSERT OR REPLACE INTO ratings VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                               ((online_judge, rating['handle'], computed_at, start_date, C_platform, D_platform, rating['old_rating'], rating['new_rating']) for rating in ratings))
+
+
+def find_contests(connection, key):
+    # key is either online_judge/contest_id or a sheet name
+    online_judge, _, contest_id = key.partition('/')
+    rows = connection.execute('SELECT * FROM contests WHERE online_judge = ? AND contest_id = ?', (online_judge, contest_id)).fetchall()
+    if not rows:
+        rows = connection.execute('SELECT * FROM contests WHERE sheet_name = ? ORDER BY day', (key,)).fetchall()
+    return rows
+
+
+def load_results(connection, online_judge, contest_id):
+    return connection.execute(f'SELECT {", ".join(result_columns)} FROM results WHERE online_judge = ? AND contest_id = ? ORDER BY row', (online_judge, contest_id)).fetchall()
+
+
+def get_date_condition(column, since, until):
+    conditions, parameters = [], []
+    if since is not None:
+        conditions.append(f'{column} >= ?')
+        parameters.append(since.strftime('%Y-%m-%d'))
+    if until is not None:
+        conditions.append(f'{column} <= ?')
+        parameters.append(until.strftime('%Y-%m-%d'))
+    return ''.join(f' AND {condition}' for condition in conditions), parameters
+
+
+def get_user_results(connection, user, since=None, until=None):
+    # user is a name from the participants list or a handle on any judge
+    condition, parameters = get_date_condition('r.day', since, until)
+    query = ('SELECT c.day, c.sheet_name, r.online_judge, r.contest_id, r.handle, r.name, r.place, r.points, r.penalty, r.user_group '
+             'FROM results r JOIN contests c ON c.online_judge = r.online_judge AND c.contest_id = r.contest_id '
+             f'WHERE r.name = ?{condition} '
+             'UNION '
+             'SELECT c.day, c.sheet_name, r.online_judge, r.contest_id, r.handle, r.name, r.place, r.points, r.penalty, r.user_group '
+             'FROM results r JOIN contests c ON c.online_judge = r.online_judge AND c.contest_id = r.contest_id '
+             f'WHERE r.handle = ?{condition} '
+             'ORDER BY 1')
+    return connection.execute(query, [user, *parameters, user, *parameters]).fetchall()
+
+
+def get_season_contests(connection, since=None, until=None):
+    condition, parameters = get_date_condition('day', since, until)
+    return connection.execute(f'SELECT * FROM contests WHERE 1{condition} ORDER BY day, sheet_name', parameters).fetchall()
+
+
+def get_season_summary(connection, since=None, until=None):
+    condition, parameters = get_date_condition('day', since, until)
+    query = ('SELECT name, is_official, COUNT(*) AS n_contests, SUM(user_group = 0) AS n_rated, MIN(place) AS best_place '
+             f'FROM results WHERE 1{condition} GROUP BY name, is_official ORDER BY n_contests DESC, name')
+    return connection.execute(query, parameters).fetchall()
+
+
+def get_latest_ratings(connection, online_judge):
+    query = ('SELECT r.* FROM ratings r JOIN (SELECT handle, MAX(computed_at) AS computed_at FROM ratings WHERE online_judge = ? GROUP BY handle) latest '
+             'ON r.handle = latest.handle AND r.computed_at = latest.computed_at WHERE r.online_judge = ? ORDER BY r.new_rating DESC')
+    return connection.execute(query, (online_judge, online_judge)).fetchall()
+
+
+def main_cli():
+    # main imports this module, so it is imported only when the store is queried from the command line
+    import main
+
+    def read_date(date):
+        return datetime.strptime(date, '%d.%m.%Y')
+
+    parser = argparse.ArgumentParser(description='query the local store of standings and ratings')
+    parser.add_argument('--since', type=read_date, help='first day (dd.mm.yyyy) to include')
+    parser.add_argument('--until', type=read_date, help='last day (dd.mm.yyyy) to include')
+    parser.add_argument('-t', '--target', type=str, help=f'name of the table in {main.targets_directory} whose store is queried, the first one by default')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    user_parser = subparsers.add_parser('user', help='all results of a user')
+    user_parser.add_argument('user', type=str, help='name from the participants list or handle')
+    subparsers.add_parser('contests', help='stored contests')
+    subparsers.add_parser('season', help='number of contests and best place of every user')
+    ratings_parser = subparsers.add_parser('ratings', help='the latest computed ratings of a judge')
+    ratings_parser.add_argument('online_judge', type=str)
+    args = parser.parse_args()
+    try:
+        target = main.get_target(args.target)
+    except ValueError as e:
+        parser.error(str(e))
+    with opened(target.store_path) as connection:
+        if args.command == 'user':
+            for row in get_user_results(connection, args.user, args.since, args.until):
+                print(f"{row['day']} {row['online_judge']}/{row['contest_id']} \"{row['sheet_name']}\": {row['handle']}, place {row['place']}, points {row['points']}, penalty {row['penalty']}, user_group = {row['user_group']}")
+        elif args.command == 'contests':
+            for row in get_season_contests(connection, args.since, args.until):
+                print(f"{row['start_date']} {row['online_judge']}/{row['contest_id']} \"{row['sheet_name']}\"")
+        elif args.command == 'season':
+            for row in get_season_summary(connection, args.since, args.until):
+                print(f"{row['name']}{'' if row['is_official'] else ' (unofficial)'}: {row['n_contests']} contests, {row['n_rated']} rated, best place {row['best_place']}")
+        elif args.command == 'ratings':
+            for row in get_latest_ratings(connection, args.online_judge):
+                print(f"{row['handle']}: {row['old_rating']} -> {row['new_rating']}")
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -55,45 +55,46 @@ function getRatingITMO(max_points, participants, points, place) {
   return Math.min(100, 50 * points / max_points * (2 * n - 2) / (n + place - 2));
 }
 
+function getWinnerPoints(results) {
+  var winnerPoints = [-1, -1, -1];
+  for (var result of results) {
+    if (winnerPoints[result.user_group] == -1) {
+      winnerPoints[result.user_group] = result.points;
+    }
+  }
+  return winnerPoints;
+}
+
+function getStandingsRow(data, result, winnerPoints) {
+  var ratingITMO = getRatingITMO(winnerPoints[result.user_group], data.n_participants[result.user_group], result.points, result.place);
+  if (result.user_group > 0) {
+    result.place = `${result.place}${"*".repeat(result.user_group)}`;
+  }
+  var place = result.place;
+  if (data.online_judge == "atcoder") {
+    place = getAtCoderResultLink(data.contest_id, result);
+  }
+  return [place, result.user.name, getProfileLink(data.online_judge, result.user), result.points, result.penalty, result.user_group, +ratingITMO.toFixed(2)];
+}
+
 function createStandings(data) {
   var sheet = ss.insertSheet(data.sheet_name, ss.getNumSheets());
   sheet.setColumnWidth(1, 75);
   sheet.setColumnWidth(2, 300);
   sheet.setColumnWidth(3, 150);
-  sheet.setColumnWidth(4, 75);
-  sheet.setColumnWidth(5, 75);
-  sheet.setColumnWidth(6, 75);
-  sheet.setColumnWidth(7, 75);
-  sheet.getRange(1, 1).setFormula(getStandingsLink(data.online_judge, data.contest_id, "Место"));
-  sheet.getRange(1, 2).setValue("Участник");
-  sheet.getRange(1, 3).setValue("Handle");
-  sheet.getRange(1, 4).setValue("Балл");
-  sheet.getRange(1, 5).setValue("Штраф");
-  sheet.getRange(1, 6).setValue("User Group");
-  sheet.getRange(1, 7).setValue("Рейтинг");
-  var winnerPoints = [-1, -1, -1];
+  sheet.setColumnWidths(4, 4, 75);
+  writeStandings(sheet, data);
+}
+
+function writeStandings(sheet, data) {
+  var rows = [[getStandingsLink(data.online_judge, data.contest_id, "Место"), "Участник", "Handle", "Балл", "Штраф", "User Group", "Рейтинг"]];
+  var winnerPoints = getWinnerPoints(data.results);
   for (var result of data.results) {
-    if (winnerPoints[result.user_group] == -1) {
-      winnerPoints[result.user_group] = result.points;
-    }
+    rows.push(getStandingsRow(data, result, winnerPoints));
   }
-  for (var i = 0; i < data.results.length; ++i) {
-    var ratingITMO = getRatingITMO(winnerPoints[data.results[i].user_group], data.n_participants[data.results[i].user_group], data.results[i].points, data.results[i].place);
-    for (var j = 0; j < data.results[i].user_group; ++j) {
-        data.results[i].place += "*";
-    }
-    sheet.getRange(2 + i, 1).setValue(data.results[i].place);
-    if (data.online_judge == "atcoder") {
-      sheet.getRange(2 + i, 1).setFormula(getAtCoderResultLink(data.contest_id, data.results[i]));
-    } else {
-      sheet.getRange(2 + i, 1).setHorizontalAlignment("right");
-    }
-    sheet.getRange(2 + i, 2).setValue(data.results[i].user.name);
-    sheet.getRange(2 + i, 3).setFormula(getProfileLink(data.online_judge, data.results[i].user));
-    sheet.getRange(2 + i, 4).setValue(data.results[i].points);
-    sheet.getRange(2 + i, 5).setValue(data.results[i].penalty);
-    sheet.getRange(2 + i, 6).setValue(data.results[i].user_group);
-    sheet.getRange(2 + i, 7).setValue(+ratingITMO.toFixed(2));
+  sheet.getRange(1, 1, rows.length, rows[0].length).setValues(rows);
+  if (data.online_judge != "atcoder" && data.results.length > 0) {
+    sheet.getRange(2, 1, data.results.length, 1).setHorizontalAlignment("right");
   }
 }
 
@@ -142,19 +143,29 @@ function sortByTotalRating() {
   sheet.getRange(`A4:A${sheet.getLastRow()}`).setValues(places);
 }
 
+function getMainRatingFormula(column, sheetName, row) {
+  return `=INDIRECT("R1C${column}"; FALSE) * '${sheetName}'!G${row + 2}`;
+}
+
 function addStandingsToTheMainRating(data) {
   var sheet = ss.getSheetByName(table_name);
   var rowByHandle = getRowByHandle(data.online_judge);
   var column = sheet.getLastColumn() + 1;
-  sheet.getRange(1, column).setFormula(getRatingCoefficientFormula(`INDIRECT("R3C${column}"; FALSE)`));
-  sheet.getRange(2, column).setValue(data.start_date);
-  sheet.getRange(3, column).setFormula(getStandingsLink(data.online_judge, data.contest_id, data.sheet_name));
+  const lastRow = sheet.getLastRow();
+  var cells = [];
+  for (var i = 0; i < lastRow; ++i) {
+    cells.push([""]);
+  }
+  cells[0][0] = getRatingCoefficientFormula(`INDIRECT("R3C${column}"; FALSE)`);
+  cells[1][0] = data.start_date;
+  cells[2][0] = getStandingsLink(data.online_judge, data.contest_id, data.sheet_name);
   for (var i = 0; i < data.results.length; ++i) {
     var handle = getHandle(data.online_judge, data.results[i].user);
     if (handle in rowByHandle) {
-      sheet.getRange(rowByHandle[handle], column).setFormula(`INDIRECT("R1C${column}"; FALSE) * '${data.sheet_name}'!G${i + 2}`);
+      cells[rowByHandle[handle] - 1][0] = getMainRatingFormula(column, data.sheet_name, i);
     }
   }
+  sheet.getRange(1, column, cells.length, 1).setValues(cells);
   sortByTotalRating();
 }
 
@@ -256,38 +267,273 @@ function actionCreateStandings(data) {
   if (!sheetExists(data.sheet_name)) {
     createStandings(data);
     addStandingsToTheMainRating(data);
+  } else {
+    myLog(`sheet ${data.sheet_name} already exists, use refresh_standings to update it`);
   }
 }
 
-function actionUpdateRatings(data) {
-  myLog("action update");
+function refreshStandings(data) {
+  // results hold only the changed rows, consecutive rows are written with one call
+  var sheet = ss.getSheetByName(data.sheet_name);
+  var runStart = 0;
+  for (var i = 1; i <= data.results.length; ++i) {
+    if (i == data.results.length || data.results[i].row != data.results[i - 1].row + 1) {
+      var rows = data.results.slice(runStart, i).map(result => getStandingsRow(data, result, data.winner_points));
+      var range = sheet.getRange(data.results[runStart].row + 2, 1, rows.length, rows[0].length);
+      range.setValues(rows);
+      if (data.online_judge != "atcoder") {
+        range.offset(0, 0, rows.length, 1).setHorizontalAlignment("right");
+      }
+      runStart = i;
+    }
+  }
+  if (data.n_rows < data.old_n_rows) {
+    sheet.getRange(data.n_rows + 2, 1, data.old_n_rows - data.n_rows, 7).clearContent();
+  }
+}
+
+function getMainRatingColumn(sheet, sheetName) {
+  var headers = sheet.getRange(3, 1, 1, sheet.getLastColumn()).getValues()[0];
+  for (var i = headers.length - 1; i >= 0; --i) {
+    if (headers[i] == sheetName) {
+      return i + 1;
+    }
+  }
+  return -1;
+}
+
+function refreshMainRating(data) {
+  // main_table holds the users whose row in the contest sheet has changed, -1 for the removed ones
   var sheet = ss.getSheetByName(table_name);
+  var column = getMainRatingColumn(sheet, data.sheet_name);
+  if (column == -1) {
+    myLog(`FAIL, cann't find column ${data.sheet_name}`);
+    return;
+  }
   var rowByHandle = getRowByHandle(data.online_judge);
-  var handlesColumn = 4 + onlineJudges.indexOf(data.online_judge);
-  for (var i = 0; i < data.ratings.length; ++i) {
-    var handle = data.ratings[i].handle;
-    if (handle in rowByHandle) {
-      sheet.getRange(rowByHandle[handle], handlesColumn).setTextStyle(getHandleTextStyle(data.online_judge, data.ratings[i].new_rating));
-      sheet.getRange(rowByHandle[handle], handlesColumn + onlineJudges.length).setValue(`${data.ratings[i].old_rating} → ${data.ratings[i].new_rating}`);
-      const [r, g, b] = getRatingDiffColor(data.ratings[i].new_rating - data.ratings[i].old_rating);
-      sheet.getRange(rowByHandle[handle], handlesColumn + onlineJudges.length).setBackgroundRGB(r, g, b);
+  var cells = data.main_table.filter(entry => entry.handle in rowByHandle);
+  if (cells.length > 0) {
+    var rows = cells.map(entry => rowByHandle[entry.handle]);
+    var firstRow = Math.min(...rows);
+    var range = sheet.getRange(firstRow, column, Math.max(...rows) - firstRow + 1, 1);
+    var formulas = range.getFormulas();
+    cells.forEach((entry, i) => formulas[rows[i] - firstRow][0] = entry.row == -1 ? "" : getMainRatingFormula(column, data.sheet_name, entry.row));
+    range.setFormulas(formulas);
+  }
+  // changed points and places change the totals even when no user moved to another row
+  sortByTotalRating();
+}
+
+function setMainRatingColumn(column, data) {
+  // every cell of the column is written again, the ones of a deleted sheet show #REF!
+  var sheet = ss.getSheetByName(table_name);
+  const lastRow = sheet.getLastRow();
+  if (lastRow > 3) {
+    var rowByHandle = getRowByHandle(data.online_judge);
+    var formulas = [];
+    for (var i = 4; i <= lastRow; ++i) {
+      formulas.push([""]);
+    }
+    for (var i = 0; i < data.results.length; ++i) {
+      var handle = getHandle(data.online_judge, data.results[i].user);
+      if (handle in rowByHandle) {
+        formulas[rowByHandle[handle] - 4][0] = getMainRatingFormula(column, data.sheet_name, i);
+      }
+    }
+    sheet.getRange(4, column, formulas.length, 1).setFormulas(formulas);
+  }
+  sortByTotalRating();
+}
+
+function actionRebuildStandings(data) {
+  // the sheet is written from scratch or created again, the main table keeps the column of the contest
+  var sheet = ss.getSheetByName(data.sheet_name);
+  if (sheet == null) {
+    createStandings(data);
+  } else {
+    sheet.clearContents();
+    writeStandings(sheet, data);
+  }
+  var column = getMainRatingColumn(ss.getSheetByName(table_name), data.sheet_name);
+  if (column == -1) {
+    addStandingsToTheMainRating(data);
+  } else {
+    setMainRatingColumn(column, data);
+  }
+}
+
+function actionRefreshStandings(data) {
+  if (!sheetExists(data.sheet_name)) {
+    myLog(`FAIL, cann't find sheet ${data.sheet_name}`);
+    return;
+  }
+  refreshStandings(data);
+  refreshMainRating(data);
+}
+
+function getMainTableHandles(sheet) {
+  // handles are matched by value like getRowByHandle, so numeric handles are found as well
+  return sheet.getRange(4, 4, sheet.getLastRow() - 3, onlineJudges.length).getValues();
+}
+
+// only the rows of the matched users are written, in runs of consecutive rows, the other cells keep their values and formatting
+function setRatings(sheet, handles, column, onlineJudge, ratings) {
+  var rowByHandle = {};
+  for (var i = 0; i < handles.length; ++i) {
+    rowByHandle[handles[i][column]] = i;
+  }
+  var changes = [];
+  for (var rating of ratings) {
+    if (rating.handle in rowByHandle) {
+      changes.push({row: rowByHandle[rating.handle], rating: rating});
     } else {
-      myLog(`FAIL, cann't find user ${handle}`);
+      myLog(`FAIL, cann't find user ${rating.handle}`);
+    }
+  }
+  changes.sort((a, b) => a.row - b.row);
+  var start = 0;
+  while (start < changes.length) {
+    var end = start + 1;
+    while (end < changes.length && changes[end].row == changes[end - 1].row + 1) {
+      ++end;
+    }
+    var run = changes.slice(start, end);
+    sheet.getRange(4 + run[0].row, 4 + column, run.length, 1).setTextStyles(run.map(change => [getHandleTextStyle(onlineJudge, change.rating.new_rating)]));
+    var ratingsRange = sheet.getRange(4 + run[0].row, 4 + column + onlineJudges.length, run.length, 1);
+    ratingsRange.setValues(run.map(change => [`${change.rating.old_rating} → ${change.rating.new_rating}`]));
+    ratingsRange.setBackgrounds(run.map(change => {
+      const [r, g, b] = getRatingDiffColor(change.rating.new_rating - change.rating.old_rating);
+      return [`#${[r, g, b].map(x => x.toString(16).padStart(2, "0")).join("")}`];
+    }));
+    start = end;
+  }
+}
+
+function actionUpdateRatings(data) {
+  var sheet = ss.getSheetByName(table_name);
+  setRatings(sheet, getMainTableHandles(sheet), onlineJudges.indexOf(data.online_judge), data.online_judge, data.ratings);
+}
+
+// the handles of all judges are read once
+function actionUpdateAllRatings(data) {
+  var sheet = ss.getSheetByName(table_name);
+  var handles = getMainTableHandles(sheet);
+  for (var update of data.updates) {
+    setRatings(sheet, handles, onlineJudges.indexOf(update.online_judge), update.online_judge, update.ratings);
+  }
+}
+
+function benchmarkCreateStandings() {
+  var data = {
+    sheet_name: `Benchmark ${Date.now()}`,
+    online_judge: "codeforces",
+    contest_id: "1",
+    start_date: "01.01.2024",
+    n_participants: [500, 0, 0],
+    results: []
+  };
+  for (var i = 0; i < 500; ++i) {
+    data.results.push({
+      user: {name: `User ${i}`, codeforces_handle: `handle${i}`, atcoder_handle: "", tlx_handle: "", is_official: true},
+      place: i + 1,
+      points: 500 - i,
+      penalty: i,
+      user_group: 0
+    });
+  }
+  var startTime = Date.now();
+  createStandings(data);
+  SpreadsheetApp.flush();
+  Logger.log(`createStandings for ${data.results.length} rows: ${Date.now() - startTime} ms`);
+  ss.deleteSheet(ss.getSheetByName(data.sheet_name));
+}
+
+function decodeColumns(columns) {
+  var fields = Object.keys(columns);
+  var rows = [];
+  for (var i = 0; i < columns[fields[0]].length; ++i) {
+    var row = {};
+    for (var field of fields) {
+      row[field] = columns[field][i];
+    }
+    rows.push(row);
+  }
+  return rows;
+}
+
+function decodePayload(contents) {
+  var data = JSON.parse(contents);
+  if (data.encoding == "gzip+base64") {
+    var blob = Utilities.newBlob(Utilities.base64Decode(data.payload), "application/x-gzip");
+    data = JSON.parse(Utilities.ungzip(blob).getDataAsString("UTF-8"));
+  }
+  if (data.format != 2) {
+    return data;
+  }
+  if (data.action == "add_standings" || data.action == "refresh_standings" || data.action == "rebuild_standings") {
+    var users = data.users.map(values => {
+      var user = {};
+      data.user_fields.forEach((field, i) => user[field] = values[i]);
+      return user;
+    });
+    data.results = decodeColumns(data.results);
+    for (var result of data.results) {
+      result.user = users[result.user];
     }
+  } else if (data.action == "update_ratings") {
+    data.ratings = decodeColumns(data.ratings);
+  } else if (data.action == "update_all_ratings") {
+    for (var update of data.updates) {
+      update.ratings = decodeColumns(update.ratings);
+    }
+  }
+  if (data.action == "refresh_standings") {
+    data.main_table = decodeColumns(data.main_table);
   }
+  return data;
+}
+
+// keys of the last uploads are kept in the script properties, a single property holds up to 9 KB
+var maxProcessedUploads = 200;
+
+function getProcessedUploads() {
+  var keys = PropertiesService.getScriptProperties().getProperty("processed_uploads");
+  return keys ? JSON.parse(keys) : [];
+}
+
+function markUploadProcessed(key) {
+  var keys = getProcessedUploads();
+  keys.push(key);
+  PropertiesService.getScriptProperties().setProperty("processed_uploads", JSON.stringify(keys.slice(-maxProcessedUploads)));
 }
 
 function doPost(e) {
+  var key = e.parameter.idempotency_key;
   var lock = LockService.getPublicLock(); 
   lock.waitLock(30000);
   try {
-    var data = JSON.parse(e.postData.contents);
-    myLog(data);
+    // the client resends an upload with the same key when it did not see the answer
+    if (key && getProcessedUploads().indexOf(key) != -1) {
+      myLog(`duplicate upload ${key} is ignored`);
+      return ContentService.createTextOutput("duplicate");
+    }
+    var data = decodePayload(e.postData.contents);
+    myLog(`${data.action}: ${e.postData.contents.length} bytes`);
     if (data.action == "add_standings") {
       actionCreateStandings(data);
     } else if (data.action == "update_ratings") {
       actionUpdateRatings(data);
+    } else if (data.action == "update_all_ratings") {
+      actionUpdateAllRatings(data);
+    } else if (data.action == "refresh_standings") {
+      actionRefreshStandings(data);
+    } else if (data.action == "rebuild_standings") {
+      actionRebuildStandings(data);
+    }
+    if (key) {
+      markUploadProcessed(key);
     }
+    return ContentService.createTextOutput("ok");
   } finally {
     lock.releaseLock();
   }
@@ -0,0 +1,2 @@
+python main.py -r --all
+pause
\ No newline at end of file